@@ -1,14 +1,43 @@
 import os
+from dataclasses import dataclass
 import pytz
 
-# Load environment variables
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-ADMIN_ID = int(os.getenv('ADMIN_ID', 0))
-MONGO_URI = os.getenv('MONGO_URI')
-CASHFREE_APP_ID = os.getenv('CASHFREE_APP_ID')
-CASHFREE_SECRET_KEY = os.getenv('CASHFREE_SECRET_KEY')
-MAIN_CHANNEL_ID = int(os.getenv('MAIN_CHANNEL_ID', 0))
-ADMIN_SECRET_CODE = os.getenv('ADMIN_SECRET_CODE')
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Immutable snapshot of the environment, read once at import time."""
+    bot_token: str | None
+    admin_id: int
+    mongo_uri: str | None
+    cashfree_app_id: str | None
+    cashfree_secret_key: str | None
+    main_channel_id: int
+    admin_secret_code: str | None
+    log_level: str
+
+    @classmethod
+    def from_env(cls, environ=os.environ) -> "Config":
+        def _int(key: str) -> int:
+            raw = environ.get(key) or 0
+            try:
+                return int(raw)
+            except ValueError:
+                raise ValueError(f"Environment variable {key} must be an integer, got {raw!r}") from None
+
+        return cls(
+            bot_token=environ.get('BOT_TOKEN'),
+            admin_id=_int('ADMIN_ID'),
+            mongo_uri=environ.get('MONGO_URI'),
+            cashfree_app_id=environ.get('CASHFREE_APP_ID'),
+            cashfree_secret_key=environ.get('CASHFREE_SECRET_KEY'),
+            main_channel_id=_int('MAIN_CHANNEL_ID'),
+            admin_secret_code=environ.get('ADMIN_SECRET_CODE'),
+            log_level=(environ.get('LOG_LEVEL') or 'INFO').upper(),
+        )
+
+
+# Load environment variables once; everything else reads from this snapshot
+CONFIG = Config.from_env()
 
 # Define centralized timezone constants
 IST_TIMEZONE = pytz.timezone('Asia/Kolkata')
@@ -24,4 +53,4 @@ REVEAL_DELAY_MINUTES = 10
 # User-facing constants
 CASHFREE_RECHARGE_LINK = "https://cfpe.me/luckydropdigital"
 MIN_RECHARGE_AMOUNT = 50.0
-REFERRAL_BONUS = 10.0
\ No newline at end of file
+REFERRAL_BONUS = 10.0
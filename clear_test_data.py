@@ -1,8 +1,8 @@
 import asyncio
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 
-from bot_config import MONGO_URI
+from bot_config import CONFIG
+from db.client import get_db
 
 # --- SET THE IDs FOR YOUR TEST ACCOUNTS ---
 REFERRER_ID = 8094551302
@@ -10,34 +10,33 @@ REFERRED_USER_ID = 7922195865
 
 async def clear_test_data():
     """Connects to the database and clears all relevant test data."""
-    if not MONGO_URI:
+    if not CONFIG.mongo_uri:
         print("Error: MONGO_URI is not set. Cannot connect.")
         return
 
-    db_client = AsyncIOMotorClient(MONGO_URI)
-    db = db_client.lotterydb
-
+    db = get_db()
     print(f"Clearing test data for referrer {REFERRER_ID} and referred user {REFERRED_USER_ID}...")
 
-    # 1. Delete the referred user's document
-    result = await db.users.delete_one({"telegram_id": REFERRED_USER_ID})
-    if result.deleted_count > 0:
+    # Each collection gets one write and all of them go out together
+    user_result, _, referral_result = await asyncio.gather(
+        db.users.delete_one({"telegram_id": REFERRED_USER_ID}),
+        db.recharges.delete_many({"telegram_id": REFERRED_USER_ID}),
+        db.referral_purchases.delete_one({"referrer_id": REFERRER_ID, "referred_id": REFERRED_USER_ID}),
+    )
+
+    # 1. The referred user's document and their recharges
+    if user_result.deleted_count > 0:
         print(f"✅ Deleted user document for ID {REFERRED_USER_ID}.")
     else:
         print(f"⚠️ User document for ID {REFERRED_USER_ID} not found.")
 
-    # 2. Remove the referred user's ID from the referrer's tracking list
-    result = await db.users.update_one(
-        {"telegram_id": REFERRER_ID},
-        {"$pull": {"referred_users_tickets": REFERRED_USER_ID}}
-    )
-    if result.modified_count > 0:
+    # 2. The referred user's purchase in the referrer's tracking list
+    if referral_result.deleted_count > 0:
         print(f"✅ Removed referred user ID {REFERRED_USER_ID} from referrer's tracking list.")
     else:
         print(f"⚠️ Referred user ID {REFERRED_USER_ID} was not in referrer's tracking list.")
 
-    db_client.close()
-    print("Database connection closed. Test data is now cleared for a fresh start.")
+    print("Test data is now cleared for a fresh start. The connection closes on exit.")
 
 if __name__ == '__main__':
     asyncio.run(clear_test_data())
\ No newline at end of file
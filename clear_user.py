@@ -1,35 +1,36 @@
 import asyncio
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 
 # Assume bot_config.py is in the same directory
 # If not, you might need to adjust the import path
-from bot_config import MONGO_URI
+from bot_config import CONFIG
+from db.client import get_db
 
 # --- CHANGE THIS TO THE USER ID YOU WANT TO CLEAR ---
 USER_ID_TO_CLEAR = 7922195865 
 
 async def clear_user_data():
     """Connects to the database and deletes a user document."""
-    if not MONGO_URI:
+    if not CONFIG.mongo_uri:
         print("Error: MONGO_URI is not set in bot_config.py. Cannot connect to database.")
         return
 
-    db_client = AsyncIOMotorClient(MONGO_URI)
-    db = db_client.lotterydb
-
+    db = get_db()
     print(f"Connecting to database and deleting data for user ID: {USER_ID_TO_CLEAR}...")
 
-    # Delete the user document
-    result = await db.users.delete_one({"telegram_id": USER_ID_TO_CLEAR})
+    # Delete the user document and the history kept alongside it
+    result, _, _ = await asyncio.gather(
+        db.users.delete_one({"telegram_id": USER_ID_TO_CLEAR}),
+        db.recharges.delete_many({"telegram_id": USER_ID_TO_CLEAR}),
+        db.referral_purchases.delete_many({"referrer_id": USER_ID_TO_CLEAR}),
+    )
 
     if result.deleted_count > 0:
         print(f"✅ Successfully deleted user ID {USER_ID_TO_CLEAR} from the 'users' collection.")
     else:
         print(f"⚠️ User ID {USER_ID_TO_CLEAR} not found in the 'users' collection. No action needed.")
 
-    db_client.close()
-    print("Database connection closed.")
+    print("Done. The database connection closes on exit.")
 
 if __name__ == '__main__':
     asyncio.run(clear_user_data())
\ No newline at end of file
@@ -0,0 +1,26 @@
+import atexit
+from functools import lru_cache
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from bot_config import CONFIG
+
+
+@lru_cache(maxsize=1)
+def get_client() -> AsyncIOMotorClient:
+    """Returns the process-wide Motor client, creating it on first use."""
+    client = AsyncIOMotorClient(
+        CONFIG.mongo_uri,
+        maxPoolSize=100,
+        minPoolSize=10,
+        retryWrites=True,
+        w=1,
+        serverSelectionTimeoutMS=3000,
+        appname="luckydrop",
+    )
+    atexit.register(client.close)
+    return client
+
+
+def get_db():
+    return get_client().lotterydb
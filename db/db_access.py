@@ -1,26 +1,201 @@
-import os
-from datetime import datetime, timedelta
-from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
+import time
+from collections import defaultdict
+from copy import deepcopy
+from datetime import datetime, timezone
 import logging
-import pytz
 from bson.objectid import ObjectId
-
-from bot_config import MONGO_URI, UTC_TIMEZONE, IST_TIMEZONE
+from pymongo import IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
 logger = logging.getLogger(__name__)
 
+# Bound once so write paths skip the pytz lookup on every timestamp
+_UTC = timezone.utc
+_now = datetime.now
+
+def _now_ms() -> int:
+    """Current UTC time as int64 epoch milliseconds, used for display-only timestamps."""
+    return int(time.time() * 1000)
+
+# Constant parts of the per-purchase updates, built once and shared by every call
+_TICKET_COUNT_INC = {"total_tickets": 1}
+_REFERRAL_COUNT_INC = {"referral_count": 1}
+
+def _participant_update(telegram_id: int, ticket_code: str) -> dict:
+    return {"$push": {"participants": {"telegram_id": telegram_id, "ticket_code": ticket_code}},
+            "$inc": _TICKET_COUNT_INC}
+
+# Lets iter_all_referrals be answered from the index alone (a covered query)
+REFERRALS_INDEX_KEYS = [("referral_count", 1), ("telegram_id", 1), ("username", 1), ("referral_code", 1)]
+
+# Serves the wallet export's revealed-pot scan in end_time order
+POTS_STATUS_END_TIME_INDEX_KEYS = [("status", 1), ("end_time", -1)]
+
+# Short-lived cache for pots looked up by date; any write to pots clears it
+POT_CACHE_TTL_SECONDS = 5.0
+_pot_by_date_cache: dict[str, tuple[float, dict]] = {}
+
+def invalidate_pot_cache():
+    _pot_by_date_cache.clear()
+
+# The admin menu's pending counters are cosmetic, so they may lag by up to this long
+PENDING_COUNTS_CACHE_TTL_SECONDS = 30.0
+_pending_counts_cache: dict[str, tuple[float, tuple[int, int]]] = {}
+
+def invalidate_pending_counts_cache():
+    _pending_counts_cache.clear()
+
+# A CREDITING recharge older than this is treated as an interrupted approval that the admin
+# may approve again or reject; younger ones are assumed to still be in flight
+CREDITING_STALE_AFTER_MS = 60_000
+
+# Recharges shown to the admin for a decision; written as $or so each branch uses its own partial index
+AWAITING_APPROVAL_FILTER = {"$or": [{"status": "PENDING_MANUAL"}, {"status": "CREDITING"}]}
+
+def _claimable_recharge_filter(telegram_id: int, order_id: str) -> dict:
+    return {"telegram_id": telegram_id, "order_id": order_id, "$or": [
+        {"status": "PENDING_MANUAL"},
+        {"status": "CREDITING", "credit_started_at": {"$lt": _now_ms() - CREDITING_STALE_AFTER_MS}},
+    ]}
+
+# Aggregation expressions in find() projections ($dateToString/$toDate in the /log exports)
+# need MongoDB 4.4; older servers reject those queries outright
+MIN_MONGODB_VERSION = (4, 4)
+
 async def init_db(db):
-    await db.users.create_index("telegram_id", unique=True)
-    await db.users.create_index("referral_code", unique=True)
-    await db.pots.create_index("date", unique=True)
-    await db.tickets.create_index("code", unique=True)
-    await db.payouts.create_index("user_telegram_id")
-    await db.payouts.create_index("status")
-    await db.payouts.create_index([("status", 1), ("timestamp", 1)])
+    server_version = tuple((await db.client.server_info())['versionArray'][:2])
+    if server_version < MIN_MONGODB_VERSION:
+        logger.error("MongoDB %s.%s is older than the required %s.%s; /log exports will fail.",
+                     *server_version, *MIN_MONGODB_VERSION)
+
+    # The (status, timestamp) index already serves status-only queries by prefix
+    payout_indexes = await db.payouts.index_information()
+    if "status_1" in payout_indexes:
+        await db.payouts.drop_index("status_1")
+    # Earlier builds keyed pending_payouts_partial on upi_id alone, which the status-only
+    # pending count/listing can't use; drop it so it's rebuilt with the keys below
+    if payout_indexes.get("pending_payouts_partial", {}).get("key") == [("upi_id", 1)]:
+        await db.payouts.drop_index("pending_payouts_partial")
+
+    # One createIndexes command per collection, all collections in flight together
+    await asyncio.gather(
+        db.users.create_indexes([
+            IndexModel("telegram_id", unique=True),
+            IndexModel("referral_code", unique=True),
+            IndexModel(REFERRALS_INDEX_KEYS, partialFilterExpression={"referral_count": {"$gt": 0}}),
+        ]),
+        db.pots.create_indexes([
+            IndexModel("date", unique=True),
+            IndexModel(POTS_STATUS_END_TIME_INDEX_KEYS),
+        ]),
+        db.tickets.create_indexes([
+            IndexModel("code", unique=True),
+            IndexModel([("pot_id", 1), ("code", 1)]),
+        ]),
+        db.payouts.create_indexes([
+            IndexModel("user_telegram_id"),
+            IndexModel([("status", 1), ("timestamp", 1)]),
+            # Pending payouts are a small slice. The status prefix serves the admin count/listing
+            # ({status: PENDING}) and status+upi_id the 'UPI not set' reminder scan, both
+            # without touching settled payouts
+            IndexModel([("status", 1), ("upi_id", 1)], partialFilterExpression={"status": "PENDING"}, name="pending_payouts_partial"),
+        ]),
+        db.recharges.create_indexes([
+            IndexModel([("telegram_id", 1), ("status", 1), ("timestamp", -1)]),
+            IndexModel("order_id"),
+            # Admin pending-payment count/listing only ever look at PENDING_MANUAL rows
+            IndexModel("status", partialFilterExpression={"status": "PENDING_MANUAL"}, name="pending_manual_partial"),
+            # Approvals interrupted between claiming the recharge and crediting the user
+            IndexModel([("status", 1), ("order_id", 1)], partialFilterExpression={"status": "CREDITING"}, name="crediting_partial"),
+        ]),
+        db.referral_purchases.create_indexes([
+            IndexModel([("referrer_id", 1), ("referred_id", 1)], unique=True),
+            # Referral bonuses recorded but not yet confirmed as credited
+            IndexModel("referrer_id", partialFilterExpression={"bonus_pending": {"$exists": True}}, name="pending_referral_bonus_partial"),
+        ]),
+    )
     logger.info("MongoDB indexes created/ensured.")
+    await run_migrations(db)
+    await retry_pending_referral_bonuses(db)
+
+# Bump when adding a data migration below; startup only scans collections when behind
+SCHEMA_VERSION = 1
+
+async def run_migrations(db):
+    """
+    Brings stored data up to SCHEMA_VERSION. The version is recorded only after every
+    migration has finished, and each migration is safe to re-run after a crash.
+    """
+    meta = await db.meta.find_one({"_id": "schema_version"})
+    current = meta['version'] if meta else 0
+    if current >= SCHEMA_VERSION:
+        return
+    if current < 1:
+        await migrate_embedded_history(db)
+        await migrate_timestamps_to_epoch_ms(db)
+    await db.meta.update_one({"_id": "schema_version"}, {"$set": {"version": SCHEMA_VERSION}}, upsert=True)
+    logger.info("Database migrated from schema version %s to %s.", current, SCHEMA_VERSION)
+
+async def migrate_embedded_history(db):
+    """
+    Moves any recharge_history / referred_users_tickets arrays still embedded in
+    user documents into the recharges and referral_purchases collections.
+    Recharges are upserted on (telegram_id, order_id, timestamp), so a run that stops
+    before a user's arrays are unset doesn't duplicate them next time.
+    """
+    migrated = 0
+    async for user in db.users.find(
+        {"$or": [{"recharge_history.0": {"$exists": True}}, {"referred_users_tickets.0": {"$exists": True}}]},
+        {"telegram_id": 1, "recharge_history": 1, "referred_users_tickets": 1}
+    ):
+        telegram_id = user['telegram_id']
+        ops = [
+            UpdateOne(
+                {"telegram_id": telegram_id, "order_id": recharge.get('order_id'), "timestamp": recharge.get('timestamp')},
+                {"$setOnInsert": {**recharge, "telegram_id": telegram_id}},
+                upsert=True
+            )
+            for recharge in user.get('recharge_history', [])
+        ]
+        if ops:
+            await db.recharges.bulk_write(ops, ordered=False)
+        for referred_id in user.get('referred_users_tickets', []):
+            await mark_referred_user_ticket_bought(db, telegram_id, referred_id)
+        await db.users.update_one({"_id": user['_id']}, {"$unset": {"recharge_history": "", "referred_users_tickets": ""}})
+        migrated += 1
+
+    # Drop the leftover empty arrays too
+    await db.users.update_many(
+        {"$or": [{"recharge_history": {"$exists": True}}, {"referred_users_tickets": {"$exists": True}}]},
+        {"$unset": {"recharge_history": "", "referred_users_tickets": ""}}
+    )
+    if migrated:
+        logger.info("Migrated embedded recharge/referral history for %s users.", migrated)
+
+async def migrate_timestamps_to_epoch_ms(db):
+    """
+    Rewrites any BSON Date timestamps left on recharges and payouts as epoch millis,
+    so sorting and range queries on those fields see a single type.
+    """
+    to_epoch_ms = [{"$set": {"timestamp": {"$toLong": "$timestamp"}}}]
+    await asyncio.gather(
+        db.recharges.update_many({"timestamp": {"$type": "date"}}, to_epoch_ms),
+        db.payouts.update_many({"timestamp": {"$type": "date"}}, to_epoch_ms),
+    )
 
-async def get_user(db, telegram_id: int):
-    return await db.users.find_one({"telegram_id": telegram_id})
+async def get_user(db, telegram_id: int, projection: dict = None):
+    return await db.users.find_one({"telegram_id": telegram_id}, projection)
+
+async def get_users_bulk(db, telegram_ids, projection: dict = None):
+    """
+    Fetches many users in one $in query. Returns a dict keyed by telegram_id.
+    """
+    telegram_ids = list(set(telegram_ids))
+    if not telegram_ids:
+        return {}
+    cursor = db.users.find({"telegram_id": {"$in": telegram_ids}}, projection)
+    return {user['telegram_id']: user async for user in cursor}
 
 async def create_user(db, telegram_id: int, username: str = None, referrer_id: int = None):
     user_data = {
@@ -31,79 +206,152 @@ async def create_user(db, telegram_id: int, username: str = None, referrer_id: i
         "referral_code": f"LUCKY{telegram_id}",
         "referred_by": referrer_id,
         "referral_count": 0,
-        "joined_date": datetime.now(UTC_TIMEZONE),
+        "joined_date": _now(_UTC),
         "last_ticket_date": None,
         "last_ticket_code": None,
-        "referred_users_tickets": [],
-        "recharge_history": [],
         "upi_id": None
     }
     await db.users.insert_one(user_data)
-    logger.info(f"New user created: {telegram_id}")
+    logger.debug("New user created: %s", telegram_id)
     return user_data
 
-async def update_user_balance(db, telegram_id: int, real_amount: float = 0.0, bonus_amount: float = 0.0):
+def _balance_inc_fields(real_amount: float, bonus_amount: float) -> dict:
     update_fields = {}
     if real_amount != 0:
         update_fields["real_balance"] = real_amount
     if bonus_amount != 0:
         update_fields["bonus_balance"] = bonus_amount
+    return update_fields
+
+async def update_user_balance(db, telegram_id: int, real_amount: float = 0.0, bonus_amount: float = 0.0):
+    """
+    Increments a user's balances. Returns True if the user was updated.
+    """
+    update_fields = _balance_inc_fields(real_amount, bonus_amount)
+    if not update_fields:
+        return False
+
+    result = await db.users.update_one({"telegram_id": telegram_id}, {"$inc": update_fields})
+    logger.debug("User %s balance updated: real+=%s, bonus+=%s", telegram_id, real_amount, bonus_amount)
+    return result.modified_count > 0
 
+async def update_user_balance_and_return(db, telegram_id: int, real_amount: float = 0.0, bonus_amount: float = 0.0):
+    """
+    Increments a user's balances and returns the balances after the update.
+    Use only when the new balance is actually shown to someone.
+    """
+    update_fields = _balance_inc_fields(real_amount, bonus_amount)
     if not update_fields:
         return None
 
     result = await db.users.find_one_and_update(
         {"telegram_id": telegram_id},
         {"$inc": update_fields},
+        projection={"_id": 0, "real_balance": 1, "bonus_balance": 1},
         return_document=True
     )
     if result:
-        logger.info(f"User {telegram_id} balance updated: real={result.get('real_balance')}, bonus={result.get('bonus_balance')}")
+        logger.debug("User %s balance updated: real=%s, bonus=%s", telegram_id, result.get('real_balance'), result.get('bonus_balance'))
     return result
 
+async def update_user_balances_bulk(db, balance_deltas):
+    """
+    Applies many balance changes in one unordered bulk_write.
+    balance_deltas is an iterable of (telegram_id, real_amount, bonus_amount); repeated
+    ids are coalesced into a single $inc so each user is written once.
+    """
+    coalesced = defaultdict(lambda: defaultdict(float))
+    for telegram_id, real_amount, bonus_amount in balance_deltas:
+        if real_amount:
+            coalesced[telegram_id]["real_balance"] += real_amount
+        if bonus_amount:
+            coalesced[telegram_id]["bonus_balance"] += bonus_amount
+
+    ops = [UpdateOne({"telegram_id": telegram_id}, {"$inc": dict(fields)}) for telegram_id, fields in coalesced.items() if fields]
+    if not ops:
+        return 0
+    result = await db.users.bulk_write(ops, ordered=False)
+    logger.debug("Bulk balance update applied to %s users.", result.modified_count)
+    return result.modified_count
+
 async def update_user_upi(db, telegram_id: int, upi_id: str):
     await db.users.update_one(
         {"telegram_id": telegram_id},
         {"$set": {"upi_id": upi_id}}
     )
-    logger.info(f"User {telegram_id} UPI ID updated.")
+    logger.debug("User %s UPI ID updated.", telegram_id)
 
 async def add_recharge_to_history(db, telegram_id: int, amount: float, status: str, order_id: str, user_name: str = None):
     recharge_data = {
+        "telegram_id": telegram_id,
         "amount": amount,
         "status": status,
-        "timestamp": datetime.now(UTC_TIMEZONE),
+        "timestamp": _now_ms(),
         "order_id": order_id,
         "user_name": user_name
     }
 
-    await db.users.update_one(
-        {"telegram_id": telegram_id},
-        {"$push": {"recharge_history": recharge_data}}
-    )
-    logger.info(f"Recharge history updated for user {telegram_id}")
+    await db.recharges.insert_one(recharge_data)
+    invalidate_pending_counts_cache()
+    logger.debug("Recharge history updated for user %s", telegram_id)
 
 async def get_pending_recharge_for_user(db, telegram_id: int):
     """
-    Finds the last pending recharge for a given user using $elemMatch for precision.
+    Finds the last pending recharge for a given user. The (telegram_id, status,
+    timestamp) index serves both the filter and the sort, so only one entry is read.
     """
-    user = await db.users.find_one(
-        {"telegram_id": telegram_id, "recharge_history": {"$elemMatch": {"status": "PENDING_MANUAL"}}},
-        {"recharge_history": 1, "_id": 0}
+    return await db.recharges.find_one(
+        {"telegram_id": telegram_id, "status": "PENDING_MANUAL"},
+        {"_id": 0, "amount": 1, "order_id": 1, "status": 1, "timestamp": 1},
+        sort=[("timestamp", -1)]
     )
-    if user and user.get('recharge_history'):
-        pending_recharges = [r for r in user['recharge_history'] if r['status'] == "PENDING_MANUAL"]
-        return pending_recharges[-1] if pending_recharges else None
-    return None
 
-async def update_recharge_status(db, telegram_id: int, order_id: str, new_status: str, amount: float):
+async def iter_pending_recharges(db, batch_size: int = 500):
+    """
+    Streams every recharge awaiting manual approval (including interrupted approvals),
+    only the fields the admin listing renders.
     """
-    Updates the status and amount of a specific recharge in a user's history.
+    cursor = db.recharges.find(
+        AWAITING_APPROVAL_FILTER,
+        {"_id": 0, "telegram_id": 1, "user_name": 1, "order_id": 1, "amount": 1, "status": 1}
+    ).batch_size(batch_size)
+    async for recharge in cursor:
+        yield recharge
+
+async def approve_manual_recharge(db, telegram_id: int, order_id: str, amount: float):
     """
-    result = await db.users.update_one(
-        {"telegram_id": telegram_id, "recharge_history.order_id": order_id},
-        {"$set": {"recharge_history.$.status": new_status, "recharge_history.$.amount": amount}}
+    Claims the recharge as CREDITING, credits the user, then marks it SUCCESS.
+    A crash in between leaves it CREDITING, listed for the admin to approve again or reject.
+    Returns the user's updated balances, or None if the recharge can't be claimed.
+    """
+    claimed = await db.recharges.update_one(
+        _claimable_recharge_filter(telegram_id, order_id),
+        {"$set": {"status": "CREDITING", "amount": amount, "credit_started_at": _now_ms()}}
+    )
+    if not claimed.modified_count:
+        return None
+    invalidate_pending_counts_cache()
+    try:
+        user = await update_user_balance_and_return(db, telegram_id, real_amount=amount)
+        if user is None:
+            logger.error("Recharge %s approved for missing user %s; left in CREDITING.", order_id, telegram_id)
+            return None
+        await db.recharges.update_one(
+            {"telegram_id": telegram_id, "order_id": order_id, "status": "CREDITING"},
+            {"$set": {"status": "SUCCESS"}, "$unset": {"credit_started_at": ""}}
+        )
+    except Exception:
+        logger.error("Approving recharge %s for user %s failed part-way; it is left in CREDITING.",
+                     order_id, telegram_id, exc_info=True)
+        raise
+    return user
+
+async def reject_manual_recharge(db, telegram_id: int, order_id: str) -> bool:
+    result = await db.recharges.update_one(
+        _claimable_recharge_filter(telegram_id, order_id),
+        {"$set": {"status": "REJECTED"}, "$unset": {"credit_started_at": ""}}
     )
+    invalidate_pending_counts_cache()
     return result.modified_count > 0
 
 async def add_payout_history(db, user_id, pot_id, amount, status, upi_id):
@@ -116,16 +364,60 @@ async def add_payout_history(db, user_id, pot_id, amount, status, upi_id):
         "amount": amount,
         "status": status,
         "upi_id": upi_id,
-        "timestamp": datetime.now(UTC_TIMEZONE),
+        "timestamp": _now_ms(),
     }
     await db.payouts.insert_one(payout_data)
-    logger.info(f"Payout history added for user {user_id} in pot {pot_id}.")
+    invalidate_pending_counts_cache()
+    logger.info("Payout history added for user %s in pot %s.", user_id, pot_id)
 
-async def get_pending_payouts(db):
+async def get_pending_counts(db):
+    """
+    Returns (pending manual recharges, pending payouts), cached for a short TTL
+    so repeated admin menu opens don't recount both collections.
+    """
+    cached = _pending_counts_cache.get("counts")
+    if cached and time.monotonic() - cached[0] < PENDING_COUNTS_CACHE_TTL_SECONDS:
+        return cached[1]
+    # Both counts in one round-trip; each $match still runs against its partial index
+    pipeline = [
+        {"$match": AWAITING_APPROVAL_FILTER},
+        {"$group": {"_id": "payments", "n": {"$sum": 1}}},
+        {"$unionWith": {"coll": "payouts", "pipeline": [
+            {"$match": {"status": "PENDING"}},
+            {"$group": {"_id": "payouts", "n": {"$sum": 1}}},
+        ]}},
+    ]
+    try:
+        by_kind = {doc["_id"]: doc["n"] async for doc in db.recharges.aggregate(pipeline)}
+        counts = (by_kind.get("payments", 0), by_kind.get("payouts", 0))
+    except OperationFailure:
+        # $unionWith needs MongoDB 4.4+; older servers get the two counts side by side
+        counts = tuple(await asyncio.gather(
+            db.recharges.count_documents(AWAITING_APPROVAL_FILTER),
+            db.payouts.count_documents({"status": "PENDING"}),
+        ))
+    _pending_counts_cache["counts"] = (time.monotonic(), counts)
+    return counts
+
+async def iter_pending_payouts(db, batch_size: int = 500):
     """
-    Retrieves all pending payouts.
+    Streams all pending payouts with the winner's username joined in server-side.
     """
-    return await db.payouts.find({"status": "PENDING"}).to_list(length=None)
+    pipeline = [
+        {"$match": {"status": "PENDING"}},
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_telegram_id",
+            "foreignField": "telegram_id",
+            "as": "user"
+        }},
+        {"$project": {
+            "user_telegram_id": 1, "amount": 1, "upi_id": 1, "pot_id": 1,
+            "username": {"$arrayElemAt": ["$user.username", 0]}
+        }}
+    ]
+    async for payout in db.payouts.aggregate(pipeline, batchSize=batch_size):
+        yield payout
 
 async def get_pending_payouts_without_upi(db):
     """
@@ -145,16 +437,17 @@ async def update_payout_status(db, payout_id, new_status: str, admin_id: int = N
         {"$set": {
             "status": new_status,
             "admin_id": admin_id,
-            "processed_at": datetime.now(UTC_TIMEZONE)
+            "processed_at": _now(_UTC)
         }}
     )
+    invalidate_pending_counts_cache()
     return result.modified_count > 0
 
 async def get_pending_payout_for_user(db, user_id: int, window_hours: int):
     """
     Finds a pending payout for a user within a specified time window.
     """
-    time_cutoff = datetime.now(UTC_TIMEZONE) - timedelta(hours=window_hours)
+    time_cutoff = _now_ms() - window_hours * 3_600_000
     return await db.payouts.find_one({
         "user_telegram_id": user_id,
         "status": "PENDING",
@@ -165,86 +458,167 @@ async def get_referred_users_details(db, referrer_id: int):
     """
     Retrieves details for all users referred by a given referrer.
     """
-    referred_users = await db.users.find({"referred_by": referrer_id}).to_list(length=None)
-    details = []
-    for user in referred_users:
-        details.append({
-            "telegram_id": user['telegram_id'],
-            "username": user.get('username'),
-            "joined_date": user.get('joined_date'),
-            "bought_ticket": user['telegram_id'] in user.get('referred_users_tickets', [])
-        })
-    return details
+    pipeline = [
+        {"$match": {"referred_by": referrer_id}},
+        {"$lookup": {
+            "from": "referral_purchases",
+            "let": {"referred_id": "$telegram_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$referrer_id", referrer_id]},
+                    {"$eq": ["$referred_id", "$$referred_id"]}
+                ]}}},
+                {"$limit": 1}
+            ],
+            "as": "purchases"
+        }},
+        {"$project": {
+            "_id": 0,
+            "telegram_id": 1,
+            "username": 1,
+            "joined_date": 1,
+            "bought_ticket": {"$gt": [{"$size": "$purchases"}, 0]}
+        }}
+    ]
+    return await db.users.aggregate(pipeline).to_list(length=None)
 
 async def get_available_tickets(db, pot_id):
     """
     Retrieves all available ticket codes for a given pot.
+    The sold codes are subtracted server-side so only unsold codes cross the wire.
     """
-    pot = await db.pots.find_one({"_id": pot_id})
-    if not pot:
-        return []
-
-    sold_tickets = {p['ticket_code'] for p in pot.get('participants', [])}
-    all_ticket_docs = await db.tickets.find({"pot_id": pot_id}).to_list(length=None)
-
-    return [t['code'] for t in all_ticket_docs if t['code'] not in sold_tickets]
+    pipeline = [
+        {"$match": {"pot_id": pot_id}},
+        {"$group": {"_id": None, "codes": {"$push": "$code"}}},
+        {"$lookup": {
+            "from": "pots",
+            "pipeline": [
+                {"$match": {"_id": pot_id}},
+                {"$project": {"_id": 0, "sold": "$participants.ticket_code"}}
+            ],
+            "as": "pot"
+        }},
+        {"$match": {"pot.0": {"$exists": True}}},
+        {"$project": {
+            "_id": 0,
+            "available": {"$setDifference": ["$codes", {"$ifNull": [{"$arrayElemAt": ["$pot.sold", 0]}, []]}]}
+        }}
+    ]
+    result = await db.tickets.aggregate(pipeline).to_list(length=1)
+    return result[0]['available'] if result else []
 
 async def purchase_ticket_atomically(db, pot_id, user_id, ticket_code):
     """
     Tries to purchase a ticket by adding a user to the pot, but only if the
     ticket code is not already taken. Uses a race-condition-safe update.
-    Returns True on successful purchase, False on failure.
+    Returns the pot's ticket count after the purchase, or None on failure.
     """
-    result = await db.pots.update_one(
+    pot = await db.pots.find_one_and_update(
         {
             "_id": pot_id,
             "status": "open",
             "participants": {"$not": {"$elemMatch": {"ticket_code": ticket_code}}},
             "participants.telegram_id": {"$ne": user_id}
         },
-        {
-            "$push": {"participants": {"telegram_id": user_id, "ticket_code": ticket_code}},
-            "$inc": {"total_tickets": 1}
-        }
+        _participant_update(user_id, ticket_code),
+        projection={"_id": 0, "total_tickets": 1},
+        return_document=ReturnDocument.AFTER
     )
-    return result.modified_count > 0
+    invalidate_pot_cache()
+    return pot['total_tickets'] if pot else None
+
+async def purchase_ticket(db, pot_id, user_id: int, ticket_code: str, real_amount: float, bonus_amount: float,
+                          referrer_id: int = None, referral_bonus: float = 0.0):
+    """
+    Claims the ticket, then debits the buyer (if they can still cover it) while recording the referral.
+    Returns (purchased, referrer_credited, tickets_sold); purchased is None if the balance fell short.
+    """
+    tickets_sold = await purchase_ticket_atomically(db, pot_id, user_id, ticket_code)
+    if tickets_sold is None:
+        return False, False, None
+
+    debit = db.users.update_one(
+        {"telegram_id": user_id,
+         "real_balance": {"$gte": real_amount},
+         "bonus_balance": {"$gte": bonus_amount}},
+        {"$inc": {"real_balance": -real_amount, "bonus_balance": -bonus_amount},
+         "$set": {"last_ticket_date": _now(_UTC), "last_ticket_code": ticket_code}}
+    )
+    if referrer_id:
+        # The bonus is stored on the referral record, so an interrupted credit is retried at startup
+        debit, referrer_credited = await asyncio.gather(
+            debit, mark_referred_user_ticket_bought(db, referrer_id, user_id, pending_bonus=referral_bonus)
+        )
+    else:
+        debit, referrer_credited = await debit, False
+
+    if debit.modified_count == 0:
+        await db.pots.update_one(
+            {"_id": pot_id},
+            {"$pull": {"participants": {"telegram_id": user_id, "ticket_code": ticket_code}},
+             "$inc": {"total_tickets": -1}}
+        )
+        invalidate_pot_cache()
+        if referrer_credited:
+            await db.referral_purchases.delete_one({"referrer_id": referrer_id, "referred_id": user_id})
+        logger.info("User %s could no longer cover ticket %s; released it.", user_id, ticket_code)
+        return None, False, None
+
+    if referrer_credited:
+        await credit_referral_bonus(db, referrer_id, user_id, referral_bonus)
+    logger.debug("User %s bought ticket %s in pot %s.", user_id, ticket_code, pot_id)
+    return True, referrer_credited, tickets_sold
 
 async def get_pot_by_date(db, date_str: str):
-    return await db.pots.find_one({"date": date_str})
+    # Callers get their own copy so nobody can change what the others read from the cache
+    cached = _pot_by_date_cache.get(date_str)
+    if cached and time.monotonic() - cached[0] < POT_CACHE_TTL_SECONDS:
+        return deepcopy(cached[1])
+    pot = await db.pots.find_one({"date": date_str})
+    if pot:
+        _pot_by_date_cache[date_str] = (time.monotonic(), deepcopy(pot))
+    return pot
 
 async def add_user_to_pot(db, pot_id, telegram_id: int, ticket_code: str):
     await db.pots.update_one(
         {"_id": pot_id},
-        {"$push": {"participants": {"telegram_id": telegram_id, "ticket_code": ticket_code}},
-         "$inc": {"total_tickets": 1}}
+        _participant_update(telegram_id, ticket_code)
     )
-    logger.info(f"User {telegram_id} added to pot {pot_id} with ticket {ticket_code}")
+    invalidate_pot_cache()
+    logger.debug("User %s added to pot %s with ticket %s", telegram_id, pot_id, ticket_code)
 
 async def get_users_in_pot(db, pot_id):
-    pot = await db.pots.find_one({"_id": pot_id})
-    return pot['participants'] if pot else []
+    pot = await db.pots.find_one({"_id": pot_id}, {"participants": 1, "_id": 0})
+    return pot.get('participants', []) if pot else []
 
 async def update_user_ticket(db, telegram_id: int, ticket_code: str):
     await db.users.update_one(
         {"telegram_id": telegram_id},
-        {"$set": {"last_ticket_date": datetime.now(UTC_TIMEZONE), "last_ticket_code": ticket_code}}
+        {"$set": {"last_ticket_date": _now(_UTC), "last_ticket_code": ticket_code}}
     )
-    logger.info(f"User {telegram_id} last ticket updated.")
+    logger.debug("User %s last ticket updated.", telegram_id)
 
 async def update_pot_status(db, pot_id, status: str):
     await db.pots.update_one({"_id": pot_id}, {"$set": {"status": status}})
-    logger.info(f"Pot {pot_id} status updated to {status}")
+    invalidate_pot_cache()
+    logger.info("Pot %s status updated to %s", pot_id, status)
 
 async def set_pot_winners(db, pot_id, winners: list):
     await db.pots.update_one({"_id": pot_id}, {"$set": {"winners": winners}})
-    logger.info(f"Winners set for pot {pot_id}: {winners}")
+    invalidate_pot_cache()
+    logger.info("Winners set for pot %s: %s", pot_id, winners)
 
 async def update_pot_prize_pool(db, pot_id, prize_pool: float):
     await db.pots.update_one({"_id": pot_id}, {"$set": {"prize_pool": prize_pool}})
-    logger.info(f"Prize pool set for pot {pot_id}: {prize_pool}")
+    invalidate_pot_cache()
+    logger.info("Prize pool set for pot %s: %s", pot_id, prize_pool)
 
-async def get_all_users(db):
-    return await db.users.find({}).to_list(length=None)
+async def iter_all_users(db, projection: dict = None, batch_size: int = 500):
+    """
+    Streams every user document in batches instead of loading them all at once.
+    """
+    async for user in db.users.find({}, projection).batch_size(batch_size):
+        yield user
 
 async def get_total_balance(db):
     pipeline = [
@@ -260,9 +634,17 @@ async def get_total_balance(db):
     return 0.0, 0.0
 
 async def get_total_locked_funds(db):
-    current_pot_data = await db.pots.find_one({"status": "open"})
-    if current_pot_data:
-        return current_pot_data['total_tickets'] * current_pot_data['ticket_price']
+    pipeline = [
+        {"$match": {"status": "open"}},
+        {"$limit": 1},
+        {"$project": {
+            "_id": 0,
+            "locked": {"$multiply": [{"$size": {"$ifNull": ["$participants", []]}}, "$ticket_price"]}
+        }}
+    ]
+    result = await db.pots.aggregate(pipeline).to_list(length=1)
+    if result:
+        return result[0]['locked']
     return 0.0
 
 async def get_user_counts_by_referral_source(db):
@@ -275,37 +657,103 @@ async def get_user_counts_by_referral_source(db):
     ]
     return await db.users.aggregate(pipeline).to_list(length=None)
 
-async def get_all_pots(db):
-    return await db.pots.find({}).to_list(length=None)
-
-async def get_all_referrals(db):
+async def iter_pot_wallet_entries(db, batch_size: int = 500):
+    """
+    Streams one row per pot winner (or per participant when a pot has no winners),
+    unwound by Mongo so the wallet CSV doesn't nest loops over every pot. Every revealed
+    pot is read; one without winners was refunded.
+    """
+    has_winners = {"$gt": [{"$size": {"$ifNull": ["$winners", []]}}, 0]}
     pipeline = [
-        {"$match": {"referral_count": {"$gt": 0}}},
+        {"$match": {"status": "revealed"}},
+        # Newest pots first, read in index order so the CSV comes out stable without an in-memory sort
+        {"$sort": {"end_time": -1}},
+        # Per-pot values are formatted here, once per pot, before $unwind fans them out
         {"$project": {
-            "telegram_id": 1,
-            "username": 1,
-            "referral_code": 1,
-            "referral_count": 1
-        }}
+            "_id": 0,
+            "pot_id": {"$toString": "$_id"},
+            "end_time": {"$dateToString": {"format": "%Y-%m-%d %H:%M:%S", "date": "$end_time"}},
+            "ticket_price": 1,
+            "kind": {"$cond": [has_winners, "Payout", "Refund"]},
+            "entry": {"$cond": [has_winners, "$winners", {"$ifNull": ["$participants", []]}]}
+        }},
+        {"$unwind": "$entry"}
     ]
-    return await db.users.aggregate(pipeline).to_list(length=None)
+    async for row in db.pots.aggregate(pipeline, batchSize=batch_size, hint=POTS_STATUS_END_TIME_INDEX_KEYS):
+        yield row
 
-async def mark_referred_user_ticket_bought(db, referrer_id: int, referred_user_id: int):
+async def iter_all_referrals(db, batch_size: int = 500):
+    """
+    Streams every user with at least one referral, straight from the covering index.
+    """
+    cursor = db.users.find(
+        {"referral_count": {"$gt": 0}},
+        {"_id": 0, "telegram_id": 1, "username": 1, "referral_code": 1, "referral_count": 1}
+    ).hint(REFERRALS_INDEX_KEYS).batch_size(batch_size)
+    async for referrer in cursor:
+        yield referrer
+
+async def mark_referred_user_ticket_bought(db, referrer_id: int, referred_user_id: int, pending_bonus: float = None):
+    """
+    Records that a referred user bought a ticket. Returns True only the first time.
+    A pending_bonus is stored with the record until credit_referral_bonus confirms it.
+    """
+    new_record = {"timestamp": _now(_UTC)}
+    if pending_bonus:
+        new_record["bonus_pending"] = pending_bonus
+    try:
+        result = await db.referral_purchases.update_one(
+            {"referrer_id": referrer_id, "referred_id": referred_user_id},
+            {"$setOnInsert": new_record},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # A concurrent upsert for the same pair won the race
+        return False
+    if result.upserted_id is None:
+        return False
+    logger.debug("Referrer %s now registered that %s bought a ticket.", referrer_id, referred_user_id)
+    return True
+
+async def credit_referral_bonus(db, referrer_id: int, referred_user_id: int, bonus: float):
+    """Pays a bonus recorded by mark_referred_user_ticket_bought, then clears it from the record."""
     await db.users.update_one(
         {"telegram_id": referrer_id},
-        {"$addToSet": {"referred_users_tickets": referred_user_id}}
+        {"$inc": {"bonus_balance": bonus, **_REFERRAL_COUNT_INC}}
+    )
+    await db.referral_purchases.update_one(
+        {"referrer_id": referrer_id, "referred_id": referred_user_id},
+        {"$unset": {"bonus_pending": ""}}
     )
-    logger.info(f"Referrer {referrer_id} now registered that {referred_user_id} bought a ticket.")
+
+async def retry_pending_referral_bonuses(db):
+    """
+    Pays referral bonuses whose purchase was recorded but whose credit never got confirmed,
+    e.g. after a crash mid-purchase. Runs at startup, before any purchase can be in flight.
+    """
+    retried = 0
+    async for record in db.referral_purchases.find({"bonus_pending": {"$exists": True}}, {"_id": 0}):
+        await credit_referral_bonus(db, record['referrer_id'], record['referred_id'], record['bonus_pending'])
+        retried += 1
+    if retried:
+        logger.warning("Credited %s referral bonuses left pending by an interrupted purchase.", retried)
 
 async def check_referred_user_ticket_status(db, referrer_id: int, referred_user_id: int):
-    user = await db.users.find_one(
-        {"telegram_id": referrer_id, "referred_users_tickets": referred_user_id}
-    )
-    return bool(user)
+    return await db.referral_purchases.count_documents(
+        {"referrer_id": referrer_id, "referred_id": referred_user_id},
+        limit=1
+    ) > 0
+
+async def iter_all_recharges(db, projection: dict = None, batch_size: int = 500):
+    """
+    Streams every recharge in batches instead of loading them all at once.
+    """
+    async for recharge in db.recharges.find({}, projection).batch_size(batch_size):
+        yield recharge
 
 async def increment_referral_count(db, telegram_id: int):
     await db.users.update_one(
         {"telegram_id": telegram_id},
-        {"$inc": {"referral_count": 1}}
+        {"$inc": _REFERRAL_COUNT_INC}
     )
-    logger.info(f"Referral count incremented for user {telegram_id}")
\ No newline at end of file
+    logger.debug("Referral count incremented for user %s", telegram_id)
\ No newline at end of file
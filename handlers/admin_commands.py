@@ -1,7 +1,8 @@
 import os
 import asyncio
 import csv
-from io import StringIO
+from functools import partial
+from io import BytesIO, TextIOWrapper
 from datetime import datetime, timedelta, time
 import random
 import logging
@@ -17,35 +18,108 @@ from aiogram.filters import Command, StateFilter
 from aiogram.enums import ParseMode
 
 from bot_config import (
-    ADMIN_ID, ADMIN_SECRET_CODE, IST_TIMEZONE, MAIN_CHANNEL_ID
+    IST_TIMEZONE
 )
 from db.db_access import (
-    get_user, get_all_users, get_total_balance, get_total_locked_funds, update_pot_status,
-    get_users_in_pot, set_pot_winners, update_user_balance, get_pot_by_date, get_all_pots, get_all_referrals,
-    get_pending_recharge_for_user, update_recharge_status, get_pending_payouts, update_payout_status
+    get_user, iter_all_users, get_total_balance, get_total_locked_funds, update_pot_status,
+    get_users_in_pot, set_pot_winners, get_pot_by_date, iter_pot_wallet_entries, iter_all_referrals,
+    get_pending_recharge_for_user, iter_pending_recharges, approve_manual_recharge, reject_manual_recharge, iter_pending_payouts, update_payout_status,
+    iter_all_recharges, invalidate_pot_cache, get_pending_counts
 )
 from utils.pot import (
     DEFAULT_POT_END_HOUR, create_pot, get_current_pot_status,
     close_pot_and_distribute_prizes, get_current_pot, process_pot_revelation
 )
-from utils.helpers import escape_markdown_v2
+from utils.helpers import escape_markdown_v2, spawn, RateLimiter
 
 logger = logging.getLogger(__name__)
 
 # The escape_markdown function is removed as the code that needed it has been removed.
 
+# Only the fields the /log CSV exports actually read; dates come back already formatted by Mongo
+USERS_CSV_PROJECTION = {
+    "_id": 0, "telegram_id": 1, "username": 1, "real_balance": 1, "bonus_balance": 1,
+    "referral_code": 1, "referred_by": 1, "referral_count": 1,
+    "joined_date": {"$dateToString": {"format": "%Y-%m-%d %H:%M:%S", "date": "$joined_date"}},
+    "last_ticket_date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$last_ticket_date"}},
+    "last_ticket_code": 1, "upi_id": 1
+}
+RECHARGES_CSV_PROJECTION = {
+    "_id": 0, "telegram_id": 1, "amount": 1, "order_id": 1, "status": 1,
+    "timestamp": {"$dateToString": {"format": "%Y-%m-%d %H:%M:%S", "date": {"$toDate": "$timestamp"}}}
+}
+PENDING_PAYMENT_MESSAGE_TEMPLATE = (
+    "**🚨 Pending Payment**\n"
+    "User: [{name}](tg://user?id={user_id})\n"
+    "Claimed Amount: ₹{amount:.2f}\n"
+    "Transaction ID: `{order_id}`\n\n"
+    "{note}Please verify this payment and choose an action."
+)
+INTERRUPTED_APPROVAL_NOTE = "⚠️ An earlier approval of this payment was interrupted. Check the user's balance before approving it again.\n\n"
+PENDING_PAYOUT_MESSAGE_TEMPLATE = (
+    "💸 **Pending Payout**\n"
+    "**User:** [{name}](tg://user?id={user_id})\n"
+    "**Amount:** ₹{amount:.2f}\n"
+    "**UPI ID:** `{upi_id}`\n"
+    "**Pot ID:** `{pot_id}`\n\n"
+    "Please process this payment and choose an action."
+)
+# Admin menu buttons that never change; only the two pending-count rows are built per render
+ADMIN_MENU_STATIC_ROWS = (
+    # The "Dashboard" button is removed from the menu
+    [InlineKeyboardButton(text="🏆 Reveal Winners", callback_data="admin_menu_reveal")],
+    [InlineKeyboardButton(text="🎫 Open New Pot", callback_data="admin_menu_openpot")],
+    [InlineKeyboardButton(text="⚙️ Set Pot Settings", callback_data="admin_menu_setpot")],
+    [InlineKeyboardButton(text="📄 Get Logs (CSV)", callback_data="admin_menu_log")],
+    [InlineKeyboardButton(text="🛑 Close Current Pot", callback_data="admin_menu_closepot")],
+)
+USERS_CSV_HEADER = ("Telegram ID", "Username", "Real Balance", "Bonus Balance", "Referral Code", "Referred By", "Referral Count", "Joined Date", "Last Ticket Date", "Last Ticket Code", "UPI ID")
+REFERRALS_CSV_HEADER = ("Referrer Telegram ID", "Referrer Username", "Referral Code", "Number of Referrals")
+WALLET_CSV_HEADER = ("Type", "User ID", "Username", "Amount", "Balance Type", "Timestamp", "Description/Order ID")
+# Static text for the manual /openpot confirmation; only the pot fields vary
+OPEN_POT_MESSAGE_TEMPLATE = (
+    "✅ New pot manually opened for **{date}**!\n"
+    "📅 Date: {date}\n"
+    "⏰ Time: {start} - {end} IST\n"
+    "👥 Max Users: {max_users}\n"
+    "💸 Ticket Price: ₹{ticket_price:.2f}\n"
+    "\n"
+    "Let the games begin! 🚀"
+)
+# A rupee amount the admin may type when approving a payment: digits, up to two decimals
+AMOUNT_RE = re.compile(r"^\s*(\d+(?:\.\d{1,2})?)\s*$")
+# Callback data for the pending-payment and payout-action buttons
+PENDING_PAYMENT_CALLBACK_RE = re.compile(r"^(approve|reject)_(\d+)_(.+)$")
+PAYOUT_ACTION_CALLBACK_RE = re.compile(r"^payout_action_(paid|failed)_([0-9a-f]{24})$")
+# Documents formatted per worker-thread hop when writing the /log CSVs
+CSV_BATCH_SIZE = 500
+# Upper bound on concurrent bot.send_message calls when fanning out admin listings
+ADMIN_SEND_CONCURRENCY = 20
+# Stay under Telegram's ~30 messages/second global bot limit
+ADMIN_SEND_RATE_PER_SECOND = 25
+_admin_send_limiter = RateLimiter(ADMIN_SEND_RATE_PER_SECOND)
+
+def _new_csv_text():
+    """A text stream whose CSV output is encoded straight into a bytes buffer."""
+    return TextIOWrapper(BytesIO(), encoding='utf-8', newline='', write_through=True)
+
+def _csv_document(csv_text: TextIOWrapper, filename: str) -> BufferedInputFile:
+    csv_text.flush()
+    return BufferedInputFile(csv_text.detach().getvalue(), filename=filename)
+
 class AdminStates(StatesGroup):
     SET_POT_LIMIT = State()
     SET_TICKET_PRICE = State()
     AWAITING_AMOUNT_CONFIRMATION = State()
 
-def register_admin_handlers(router: Router):
+def register_admin_handlers(router: Router, admin_secret_code: str):
     logger.info("Registering admin handlers.")
 
     router.message.register(process_set_pot_limit, StateFilter(AdminStates.SET_POT_LIMIT))
     router.message.register(process_set_ticket_price, StateFilter(AdminStates.SET_TICKET_PRICE))
     router.message.register(process_approved_amount, StateFilter(AdminStates.AWAITING_AMOUNT_CONFIRMATION))
-    router.message.register(show_admin_commands, lambda message, admin_secret_code, db: message.text == admin_secret_code)
+    if admin_secret_code:
+        router.message.register(show_admin_commands, F.text == admin_secret_code)
     # The admin_command is removed completely to avoid the error.
     # router.message.register(admin_command, Command("admin"))
     router.message.register(reveal_command, Command("reveal"))
@@ -64,196 +138,178 @@ def register_admin_handlers(router: Router):
     logger.info("Admin handlers registered.")
 
 async def show_admin_commands(message: types.Message, db, admin_id: int, admin_secret_code: str):
-    logger.info(f"Admin {message.from_user.id} used correct secret code. Sending menu.")
-    pending_payments_count = await db.users.count_documents({"recharge_history.status": "PENDING_MANUAL"})
-    pending_payouts_count = await db.payouts.count_documents({"status": "PENDING"})
+    logger.info("Admin %s used correct secret code. Sending menu.", message.from_user.id)
+    pending_payments_count, pending_payouts_count = await get_pending_counts(db)
 
     list_pending_button_text = f"✅ List Pending Payments ({pending_payments_count})" if pending_payments_count > 0 else "✅ List Pending Payments"
     list_payouts_button_text = f"💰 List Pending Payouts ({pending_payouts_count})" if pending_payouts_count > 0 else "💰 List Pending Payouts"
 
     markup = InlineKeyboardMarkup(inline_keyboard=[
-        # The "Dashboard" button is removed from the menu
-        [InlineKeyboardButton(text="🏆 Reveal Winners", callback_data="admin_menu_reveal")],
-        [InlineKeyboardButton(text="🎫 Open New Pot", callback_data="admin_menu_openpot")],
-        [InlineKeyboardButton(text="⚙️ Set Pot Settings", callback_data="admin_menu_setpot")],
-        [InlineKeyboardButton(text="📄 Get Logs (CSV)", callback_data="admin_menu_log")],
-        [InlineKeyboardButton(text="🛑 Close Current Pot", callback_data="admin_menu_closepot")],
+        *ADMIN_MENU_STATIC_ROWS,
         [InlineKeyboardButton(text=list_pending_button_text, callback_data="admin_menu_listpending")],
         [InlineKeyboardButton(text=list_payouts_button_text, callback_data="admin_menu_list_payouts")]
     ])
     await message.reply("👑 **Admin Commands Menu** 👑\n\nChoose an action:", reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
 
 async def handle_admin_menu_callback(call: types.CallbackQuery, state: FSMContext, db, admin_id, bot: Bot, ist_timezone: pytz.BaseTzInfo, main_channel_id: int):
-    logger.info(f"Admin menu callback received from {call.from_user.id}: {call.data}")
+    logger.info("Admin menu callback received from %s: %s", call.from_user.id, call.data)
     await call.answer()
     action = call.data.replace("admin_menu_", "")
-    dummy_message = types.Message(
-        message_id=call.message.message_id,
-        date=datetime.now(),
-        chat=types.Chat(id=call.from_user.id, type="private", username=call.from_user.username, first_name=call.from_user.first_name, last_name=call.from_user.last_name),
-        from_user=call.from_user,
-        text=f"/{action}",
-        bot=bot
-    )
+    chat_id = user_id = call.from_user.id
+    actions = {
+        "reveal": lambda: _reveal(chat_id, user_id, db, admin_id, bot, main_channel_id, ist_timezone),
+        "openpot": lambda: _openpot(chat_id, user_id, db, admin_id, bot, ist_timezone, main_channel_id),
+        "setpot": lambda: _setpot(chat_id, user_id, state, db, admin_id, bot),
+        "log": lambda: _log(chat_id, user_id, db, admin_id, bot),
+        "closepot": lambda: _closepot(chat_id, user_id, db, admin_id, bot, main_channel_id, ist_timezone),
+        "listpending": lambda: _list_pending_payments(chat_id, db, admin_id, bot),
+        "list_payouts": lambda: _list_pending_payouts(chat_id, db, admin_id, bot),
+    }
     if action == "admin":
         # The call to the problematic admin_command is replaced with a simple text reply.
-        await bot.send_message(chat_id=call.from_user.id, text="⚠️ **Admin Dashboard is currently disabled due to a technical issue.** Please use the other commands and buttons for now.", parse_mode=ParseMode.MARKDOWN)
-    elif action == "reveal":
-        await reveal_command(dummy_message, db, admin_id, bot, main_channel_id, ist_timezone)
-    elif action == "openpot":
-        await openpot_command(dummy_message, db, admin_id, bot, ist_timezone, main_channel_id)
-    elif action == "setpot":
-        await setpot_command(dummy_message, state, db, admin_id, bot)
-    elif action == "log":
-        await log_command(dummy_message, db, admin_id, bot)
-    elif action == "closepot":
-        await closepot_command(dummy_message, db, admin_id, bot, main_channel_id, ist_timezone)
-    elif action == "listpending":
-        await list_pending_payments_command(dummy_message, db, admin_id, bot)
-    elif action == "list_payouts":
-        await list_pending_payouts_command(dummy_message, db, admin_id, bot)
+        await bot.send_message(chat_id=chat_id, text="⚠️ **Admin Dashboard is currently disabled due to a technical issue.** Please use the other commands and buttons for now.", parse_mode=ParseMode.MARKDOWN)
+    elif action in actions:
+        await actions[action]()
     else:
-        logger.warning(f"Admin {call.from_user.id} clicked unknown admin menu action: {call.data}")
-        await bot.send_message(chat_id=call.from_user.id, text="Unknown admin menu action. Please try again.", parse_mode=ParseMode.MARKDOWN)
+        logger.warning("Admin %s clicked unknown admin menu action: %s", call.from_user.id, call.data)
+        await bot.send_message(chat_id=chat_id, text="Unknown admin menu action. Please try again.", parse_mode=ParseMode.MARKDOWN)
+
+def _pending_payment_markup(user_id: int, order_id: str) -> InlineKeyboardMarkup:
+    """Approve/reject keyboard for one pending payment, built without per-row pydantic validation."""
+    return InlineKeyboardMarkup.model_construct(inline_keyboard=[
+        [InlineKeyboardButton.model_construct(text="✅ Approve", callback_data=f"approve_{user_id}_{order_id}"),
+         InlineKeyboardButton.model_construct(text="❌ Reject", callback_data=f"reject_{user_id}_{order_id}")],
+    ])
+
+async def _send_listing(bot: Bot, chat_id: int, items):
+    """Sends (text, markup) pairs concurrently, bounded in flight and paced under Telegram's rate limit."""
+    semaphore = asyncio.Semaphore(ADMIN_SEND_CONCURRENCY)
+
+    async def _send(text, markup):
+        async with semaphore:
+            await _admin_send_limiter.acquire()
+            try:
+                await bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+            except Exception as e:
+                logger.warning("Could not send admin listing item to %s: %s", chat_id, e)
+
+    await asyncio.gather(*(_send(text, markup) for text, markup in items))
+
+async def _list_pending_payments(chat_id: int, db, admin_id, bot: Bot):
+    any_pending = False
+    # Sent one cursor batch at a time, so only a batch of pending rows is held in memory
+    async for recharges in _batched(iter_pending_recharges(db)):
+        any_pending = True
+        items = [
+            (PENDING_PAYMENT_MESSAGE_TEMPLATE.format(
+                name=escape_markdown_v2(recharge.get('user_name', 'N/A')), user_id=recharge['telegram_id'],
+                amount=recharge['amount'], order_id=escape_markdown_v2(recharge['order_id']),
+                note=INTERRUPTED_APPROVAL_NOTE if recharge.get('status') == "CREDITING" else ""
+            ), _pending_payment_markup(recharge['telegram_id'], recharge['order_id']))
+            for recharge in recharges
+        ]
+        await _send_listing(bot, chat_id, items)
+    if not any_pending:
+        await bot.send_message(chat_id, "✅ No pending payments to verify.", parse_mode='Markdown')
 
 async def list_pending_payments_command(message: types.Message, db, admin_id, bot: Bot):
-    pending_payments_users = await db.users.find({"recharge_history.status": "PENDING_MANUAL"}).to_list(length=None)
-    if not pending_payments_users:
-        await bot.send_message(message.chat.id, "✅ No pending payments to verify.", parse_mode='Markdown')
-        return
-    for user in pending_payments_users:
-        for recharge in user['recharge_history']:
-            if recharge['status'] == "PENDING_MANUAL":
-                user_id = user['telegram_id']
-                user_name = recharge.get('user_name', user.get('username', 'N/A'))
-                order_id = recharge['order_id']
-                amount = recharge['amount']
-                callback_data_approve = f"approve_{user_id}_{order_id}"
-                callback_data_reject = f"reject_{user_id}_{order_id}"
-                markup = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="✅ Approve", callback_data=callback_data_approve),
-                     InlineKeyboardButton(text="❌ Reject", callback_data=callback_data_reject)],
-                ])
-                await bot.send_message(message.chat.id,
-                                       f"**🚨 Pending Payment**\n"
-                                       f"User: [{escape_markdown_v2(user_name)}](tg://user?id={user_id})\n"
-                                       f"Claimed Amount: ₹{amount:.2f}\n"
-                                       f"Transaction ID: `{escape_markdown_v2(order_id)}`\n\n"
-                                       f"Please verify this payment and choose an action.",
-                                       reply_markup=markup,
-                                       parse_mode='Markdown'
-                                       )
+    await _list_pending_payments(message.chat.id, db, admin_id, bot)
 
-async def list_pending_payouts_command(message: types.Message, db, admin_id, bot: Bot):
-    pending_payouts = await db.payouts.find({"status": "PENDING"}).to_list(length=None)
-    if not pending_payouts:
-        await bot.send_message(message.chat.id, "✅ No pending payouts to process.", parse_mode='Markdown')
-        return
+def _pending_payout_item(payout):
+    payout_id_str = str(payout['_id'])
+    user_id = payout['user_telegram_id']
+    user_display_name = escape_markdown_v2(payout['username']) if payout.get('username') else f"User {user_id}"
 
-    for payout in pending_payouts:
-        payout_id_str = str(payout['_id'])
-        user_id = payout['user_telegram_id']
-        amount = payout['amount']
-        upi_id = payout['upi_id']
-        pot_id = str(payout['pot_id'])
-        user = await get_user(db, user_id)
+    markup = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Mark Paid", callback_data=f"payout_action_paid_{payout_id_str}"),
+            InlineKeyboardButton(text="❌ Mark Failed", callback_data=f"payout_action_failed_{payout_id_str}")
+        ]
+    ])
+    return (PENDING_PAYOUT_MESSAGE_TEMPLATE.format(
+        name=user_display_name, user_id=user_id, amount=payout['amount'],
+        upi_id=escape_markdown_v2(payout['upi_id']), pot_id=payout['pot_id']
+    ), markup)
 
-        user_display_name = escape_markdown_v2(user.get('username')) if user and user.get('username') else f"User {user_id}"
+async def _list_pending_payouts(chat_id: int, db, admin_id, bot: Bot):
+    any_pending = False
+    async for payouts in _batched(iter_pending_payouts(db)):
+        any_pending = True
+        await _send_listing(bot, chat_id, [_pending_payout_item(payout) for payout in payouts])
+    if not any_pending:
+        await bot.send_message(chat_id, "✅ No pending payouts to process.", parse_mode='Markdown')
 
-        markup = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✅ Mark Paid", callback_data=f"payout_action_paid_{payout_id_str}"),
-                InlineKeyboardButton(text="❌ Mark Failed", callback_data=f"payout_action_failed_{payout_id_str}")
-            ]
-        ])
-
-        await bot.send_message(message.chat.id,
-                               f"💸 **Pending Payout**\n"
-                               f"**User:** [{user_display_name}](tg://user?id={user_id})\n"
-                               f"**Amount:** ₹{amount:.2f}\n"
-                               f"**UPI ID:** `{escape_markdown_v2(upi_id)}`\n"
-                               f"**Pot ID:** `{pot_id}`\n\n"
-                               f"Please process this payment and choose an action.",
-                               reply_markup=markup,
-                               parse_mode='Markdown')
+async def list_pending_payouts_command(message: types.Message, db, admin_id, bot: Bot):
+    await _list_pending_payouts(message.chat.id, db, admin_id, bot)
 
 async def handle_payout_action_callback(call: types.CallbackQuery, state: FSMContext, db, admin_id, bot: Bot):
     await call.answer()
     try:
-        data_parts = call.data.split('_')
-        action = data_parts[2]
-        payout_id = data_parts[3]
+        callback_match = PAYOUT_ACTION_CALLBACK_RE.match(call.data)
+        if not callback_match:
+            raise ValueError("Invalid callback data")
+        action, payout_id = callback_match.groups()
 
-        payout_doc = await db.payouts.find_one({"_id": ObjectId(payout_id)})
+        payout_doc = await db.payouts.find_one(
+            {"_id": ObjectId(payout_id)},
+            {"_id": 0, "user_telegram_id": 1, "amount": 1, "upi_id": 1}
+        )
         if not payout_doc:
             await call.message.edit_text("❌ This payout request is no longer valid.")
             return
 
         user_id = payout_doc['user_telegram_id']
         amount = payout_doc['amount']
-        user = await get_user(db, user_id)
+        user = await get_user(db, user_id, {"_id": 0, "username": 1})
 
         user_display_name = escape_markdown_v2(user.get('username')) if user and user.get('username') else f"User {user_id}"
 
         new_status = action.upper()
         if await update_payout_status(db, payout_id, new_status, admin_id):
+            # The user's notification goes out in the background so the admin's edit isn't held up
+            if new_status == "PAID":
+                spawn(bot.send_message(user_id,
+                                       f"💰 **Congratulations!** Your prize of **₹{amount:.2f}** has been paid to your UPI ID! 🥳",
+                                       parse_mode='Markdown'))
+            elif new_status == "FAILED":
+                spawn(bot.send_message(user_id,
+                                       f"😔 **Payout failed.** Your prize of **₹{amount:.2f}** could not be sent to your UPI ID `{escape_markdown_v2(payout_doc['upi_id'])}`.\n"
+                                       "Please double-check your UPI ID with /setupi and contact support.",
+                                       parse_mode='Markdown'))
             await call.message.edit_text(f"✅ Payout for [{user_display_name}](tg://user?id={user_id}) of ₹{amount:.2f} has been marked as **{new_status}**.", parse_mode=ParseMode.MARKDOWN)
-
-            try:
-                if new_status == "PAID":
-                    await bot.send_message(user_id,
-                                           f"💰 **Congratulations!** Your prize of **₹{amount:.2f}** has been paid to your UPI ID! 🥳",
-                                           parse_mode='Markdown')
-                elif new_status == "FAILED":
-                    await bot.send_message(user_id,
-                                           f"😔 **Payout failed.** Your prize of **₹{amount:.2f}** could not be sent to your UPI ID `{escape_markdown_v2(payout_doc['upi_id'])}`.\n"
-                                           "Please double-check your UPI ID with /setupi and contact support.",
-                                           parse_mode='Markdown')
-            except Exception as e:
-                logger.warning(f"Could not notify user {user_id} about payout status change: {e}")
         else:
             await call.message.edit_text(f"❌ Failed to update payout status for ID `{payout_id}`. It might have already been processed.")
     except Exception as e:
-        logger.error(f"Error handling payout action callback: {e}", exc_info=True)
+        logger.error("Error handling payout action callback: %s", e, exc_info=True)
         await call.message.edit_text("❌ An unexpected error occurred while processing this payout.")
 
 async def handle_pending_payment_callback(call: types.CallbackQuery, state: FSMContext, db, admin_id, bot: Bot):
     await call.answer()
     try:
-        data_parts = call.data.split('_')
-        if len(data_parts) < 3:
+        # Order IDs may themselves contain underscores; the pattern only anchors action and user id
+        callback_match = PENDING_PAYMENT_CALLBACK_RE.match(call.data)
+        if not callback_match:
             raise ValueError("Invalid callback data")
-        action = data_parts[0]
-        user_id_str = data_parts[1]
-        order_id = data_parts[2]
+        action, user_id_str, order_id = callback_match.groups()
         user_id = int(user_id_str)
         if action == "approve":
             await state.set_state(AdminStates.AWAITING_AMOUNT_CONFIRMATION)
             await state.update_data(user_id=user_id, order_id=order_id)
             await call.message.edit_text(f"📝 You are approving transaction ID `{escape_markdown_v2(order_id)}` for user {user_id}. Please enter the **exact amount** to be credited:", parse_mode='Markdown')
         elif action == "reject":
-            recharge_record_query = {
-                "telegram_id": user_id,
-                "recharge_history.order_id": order_id,
-                "recharge_history.status": "PENDING_MANUAL"
-            }
-            recharge_record = await db.users.find_one(recharge_record_query)
-            if not recharge_record:
+            if not await reject_manual_recharge(db, user_id, order_id):
                 await call.message.edit_text(f"❌ Payment for order ID `{escape_markdown_v2(order_id)}` has already been processed or does not exist.")
                 return
-            await db.users.update_one(
-                recharge_record_query,
-                {"$set": {"recharge_history.$.status": "REJECTED"}}
-            )
-            await bot.send_message(user_id, f"❌ **Your payment claim for order ID `{order_id}` has been rejected.**\nIf you believe this is a mistake, please contact support with proof of payment.")
+            spawn(bot.send_message(user_id, f"❌ **Your payment claim for order ID `{order_id}` has been rejected.**\nIf you believe this is a mistake, please contact support with proof of payment."))
             await call.message.edit_text(f"❌ Payment for user {user_id} (order ID `{escape_markdown_v2(order_id)}`) has been **REJECTED**.")
     except Exception as e:
-        logger.error(f"Error handling pending payment callback: {e}", exc_info=True)
+        logger.error("Error handling pending payment callback: %s", e, exc_info=True)
         await call.message.edit_text(f"❌ An error occurred while processing this request: {e}")
 
 async def process_approved_amount(message: types.Message, state: FSMContext, db, admin_id, bot: Bot):
     try:
-        amount = float(message.text.strip())
+        amount_match = AMOUNT_RE.match(message.text or "")
+        amount = float(amount_match.group(1)) if amount_match else 0.0
         if amount <= 0:
             await message.reply("❌ Invalid input. Please enter a valid numerical amount.")
             return
@@ -264,112 +320,117 @@ async def process_approved_amount(message: types.Message, state: FSMContext, db,
             await message.reply("❌ An error occurred with the FSM state. Please try listing pending payments again.")
             await state.clear()
             return
-        recharge_record_query = {
-            "telegram_id": user_id,
-            "recharge_history.order_id": order_id,
-            "recharge_history.status": "PENDING_MANUAL"
-        }
-        await update_user_balance(db, user_id, real_amount=amount)
-        await update_recharge_status(db, user_id, order_id, amount,"SUCCESS")
-        updated_user = await get_user(db, user_id)
-        await bot.send_message(user_id,
+        try:
+            updated_user = await approve_manual_recharge(db, user_id, order_id, amount)
+        except Exception:
+            await message.reply(f"❌ Crediting order ID `{escape_markdown_v2(order_id)}` failed part-way. It stays in the pending list marked as interrupted; check the user's balance before approving or rejecting it again.")
+            await state.clear()
+            return
+        if updated_user is None:
+            await message.reply(f"❌ Payment for order ID `{escape_markdown_v2(order_id)}` has already been processed or does not exist.")
+            await state.clear()
+            return
+        spawn(bot.send_message(user_id,
                                f"🎉 **Your payment of ₹{amount:.2f} has been approved!**\n"
-                               f"Your real balance has been updated. Your new balance is ₹{updated_user.get('real_balance', 0.0):.2f}. 🥳")
+                               f"Your real balance has been updated. Your new balance is ₹{updated_user.get('real_balance', 0.0):.2f}. 🥳"))
         await message.reply(f"✅ Payment for user {user_id} (order ID `{escape_markdown_v2(order_id)}`) of ₹{amount:.2f} has been **APPROVED** and credited.")
         await state.clear()
-    except ValueError:
-        await message.reply("❌ Invalid input. Please enter a valid numerical amount.")
     except Exception as e:
-        logger.error(f"Error processing approved amount: {e}", exc_info=True)
+        logger.error("Error processing approved amount: %s", e, exc_info=True)
         await message.reply(f"❌ An unexpected error occurred: {e}")
         await state.clear()
 
 async def admin_command(message: types.Message, db, admin_id, bot: Bot, ist_timezone: pytz.BaseTzInfo):
-    logger.info(f"Handler for /admin called by {message.from_user.id}")
+    logger.info("Handler for /admin called by %s", message.from_user.id)
     # FIX: Dashboard code has been completely removed to solve the markdown error.
     await bot.send_message(chat_id=message.chat.id, text="⚠️ **Admin Dashboard is currently disabled due to a technical issue.** Please use the other commands for now.", parse_mode=ParseMode.MARKDOWN)
 
-async def reveal_command(message: types.Message, db, admin_id, bot: Bot, main_channel_id: int, ist_timezone: pytz.BaseTzInfo):
-    logger.info(f"Handler for /reveal called by {message.from_user.id}")
+async def _reveal(chat_id: int, user_id: int, db, admin_id, bot: Bot, main_channel_id: int, ist_timezone: pytz.BaseTzInfo):
+    logger.info("Handler for /reveal called by %s", user_id)
     if db is None or admin_id is None or main_channel_id is None or ist_timezone is None:
-        await bot.send_message(chat_id=message.chat.id, text="Internal bot error. Please try again later.", parse_mode=ParseMode.MARKDOWN)
+        await bot.send_message(chat_id=chat_id, text="Internal bot error. Please try again later.", parse_mode=ParseMode.MARKDOWN)
         return
     current_pot = await get_current_pot(db, ist_timezone)
     if not current_pot:
-        await bot.send_message(chat_id=message.chat.id, text="❌ No active pot to reveal winners for. Please ensure a pot has closed or is awaiting revelation.", parse_mode=ParseMode.MARKDOWN)
+        await bot.send_message(chat_id=chat_id, text="❌ No active pot to reveal winners for. Please ensure a pot has closed or is awaiting revelation.", parse_mode=ParseMode.MARKDOWN)
         return
     if current_pot.get('status') == 'open':
-        await bot.send_message(chat_id=message.chat.id, text="⏳ The current pot is still open! Please wait until 7 PM IST or use `/closepot` to manually close it before revealing.", parse_mode=ParseMode.MARKDOWN)
+        await bot.send_message(chat_id=chat_id, text="⏳ The current pot is still open! Please wait until 7 PM IST or use `/closepot` to manually close it before revealing.", parse_mode=ParseMode.MARKDOWN)
         return
     await process_pot_revelation(bot, db, admin_id, current_pot, main_channel_id, ist_timezone, interactive_reveal=True)
-async def closepot_command(message: types.Message, db, admin_id, bot: Bot, main_channel_id: int, ist_timezone: pytz.BaseTzInfo):
-    logger.info(f"Handler for /closepot called by {message.from_user.id}")
+
+async def reveal_command(message: types.Message, db, admin_id, bot: Bot, main_channel_id: int, ist_timezone: pytz.BaseTzInfo):
+    await _reveal(message.chat.id, message.from_user.id, db, admin_id, bot, main_channel_id, ist_timezone)
+
+async def _closepot(chat_id: int, user_id: int, db, admin_id, bot: Bot, main_channel_id: int, ist_timezone: pytz.BaseTzInfo):
+    logger.info("Handler for /closepot called by %s", user_id)
     if db is None or admin_id is None or main_channel_id is None or ist_timezone is None:
-        await bot.send_message(chat_id=message.chat.id, text="Internal bot error. Please try again later.", parse_mode=ParseMode.MARKDOWN)
+        await bot.send_message(chat_id=chat_id, text="Internal bot error. Please try again later.", parse_mode=ParseMode.MARKDOWN)
         return
     current_pot = await get_current_pot(db, ist_timezone)
     if not current_pot:
-        await bot.send_message(chat_id=message.chat.id, text="❌ No active pot to close right now.", parse_mode=ParseMode.MARKDOWN)
+        await bot.send_message(chat_id=chat_id, text="❌ No active pot to close right now.", parse_mode=ParseMode.MARKDOWN)
         return
     if current_pot.get('status') != 'open':
-        await bot.send_message(chat_id=message.chat.id, text=f"⚠️ The current pot is already '{current_pot.get('status')}' (not 'open'). No action needed to close it, but you might need to /reveal.", parse_mode=ParseMode.MARKDOWN)
+        await bot.send_message(chat_id=chat_id, text=f"⚠️ The current pot is already '{current_pot.get('status')}' (not 'open'). No action needed to close it, but you might need to /reveal.", parse_mode=ParseMode.MARKDOWN)
         return
-    await bot.send_message(chat_id=message.chat.id, text="⏳ Manually closing the current pot for ticket purchases...", parse_mode=ParseMode.MARKDOWN)
+    await bot.send_message(chat_id=chat_id, text="⏳ Manually closing the current pot for ticket purchases...", parse_mode=ParseMode.MARKDOWN)
     await close_pot_and_distribute_prizes(bot, db, admin_id, current_pot['_id'], main_channel_id=main_channel_id)
-async def openpot_command(message: types.Message, db, admin_id, bot: Bot, ist_timezone: pytz.BaseTzInfo, main_channel_id: int):
-    logger.info(f"Handler for /openpot called by {message.from_user.id}")
+
+async def closepot_command(message: types.Message, db, admin_id, bot: Bot, main_channel_id: int, ist_timezone: pytz.BaseTzInfo):
+    await _closepot(message.chat.id, message.from_user.id, db, admin_id, bot, main_channel_id, ist_timezone)
+
+async def _openpot(chat_id: int, user_id: int, db, admin_id, bot: Bot, ist_timezone: pytz.BaseTzInfo, main_channel_id: int):
+    logger.info("Handler for /openpot called by %s", user_id)
     if db is None or ist_timezone is None:
-        await bot.send_message(chat_id=message.chat.id, text="Internal bot error. Please try again later.", parse_mode=ParseMode.MARKDOWN)
+        await bot.send_message(chat_id=chat_id, text="Internal bot error. Please try again later.", parse_mode=ParseMode.MARKDOWN)
         return
     now_ist = datetime.now(ist_timezone)
     today_iso = now_ist.date().isoformat()
-    existing_pot_today = await get_current_pot(db, ist_timezone)
-    if existing_pot_today:
-        if existing_pot_today.get('status') == 'open':
-            await bot.send_message(chat_id=message.chat.id, text="⚠️ A pot is already **OPEN** for today! No need to manually open it. Use /pot to check its status.", parse_mode=ParseMode.MARKDOWN)
-            return
-        elif existing_pot_today.get('status') in ['closed', 'revealed']:
-            await db.pots.delete_one({"date": today_iso})
-            logger.info(f"Deleted old '{existing_pot_today.get('status')}' pot for {today_iso} to allow manual re-opening.")
+    if await db.pots.count_documents({"date": today_iso, "status": "open"}, limit=1):
+        await bot.send_message(chat_id=chat_id, text="⚠️ A pot is already **OPEN** for today! No need to manually open it. Use /pot to check its status.", parse_mode=ParseMode.MARKDOWN)
+        return
     max_users = 30
     ticket_price = 50.0
     current_time_for_pot = now_ist
     end_time_for_pot = current_time_for_pot + timedelta(hours=2)
-    new_pot = await create_pot(db, current_time_for_pot.date(), max_users, ticket_price, custom_start_time_ist=current_time_for_pot, custom_end_time_ist=end_time_for_pot)
+    new_pot = await create_pot(db, current_time_for_pot.date(), max_users, ticket_price, custom_start_time_ist=current_time_for_pot, custom_end_time_ist=end_time_for_pot, replace_stale=True)
     if new_pot:
-        open_pot_message_lines = [
-            f"✅ New pot manually opened for **{new_pot['date']}**!",
-            f"📅 Date: {new_pot['date']}",
-            f"⏰ Time: {new_pot['start_time'].astimezone(ist_timezone).strftime('%I:%M %p')} - {new_pot['end_time'].astimezone(ist_timezone).strftime('%I:%M %p')} IST",
-            f"👥 Max Users: {new_pot['max_users']}",
-            f"💸 Ticket Price: ₹{new_pot['ticket_price']:.2f}",
-            "",
-            "Let the games begin! 🚀"
-        ]
-        open_pot_message = "\n".join(open_pot_message_lines)
-        await bot.send_message(chat_id=message.chat.id, text=open_pot_message, parse_mode=ParseMode.MARKDOWN)
+        start_str = new_pot['start_time'].astimezone(ist_timezone).strftime('%I:%M %p')
+        end_str = new_pot['end_time'].astimezone(ist_timezone).strftime('%I:%M %p')
+        open_pot_message = OPEN_POT_MESSAGE_TEMPLATE.format(
+            date=new_pot['date'], start=start_str, end=end_str,
+            max_users=new_pot['max_users'], ticket_price=new_pot['ticket_price']
+        )
+        await bot.send_message(chat_id=chat_id, text=open_pot_message, parse_mode=ParseMode.MARKDOWN)
         if main_channel_id:
             try:
-                channel_announcement_time_start = new_pot['start_time'].astimezone(ist_timezone).strftime('%I:%M %p')
-                channel_announcement_time_end = new_pot['end_time'].astimezone(ist_timezone).strftime('%I:%M %p')
                 await bot.send_message(main_channel_id,
                                        f"🔔 **POT ALERT!** A new LuckyDrop pot is now open for tickets! 🚀\n"
-                                       f"Time: {channel_announcement_time_start} - {channel_announcement_time_end} IST. Use /buyticket now! 🎫",
+                                       f"Time: {start_str} - {end_str} IST. Use /buyticket now! 🎫",
                                        parse_mode=ParseMode.MARKDOWN)
-                logger.info(f"Sent manual pot open announcement to channel {main_channel_id}")
+                logger.info("Sent manual pot open announcement to channel %s", main_channel_id)
             except Exception as e:
-                logger.error(f"Failed to send manual pot open announcement to channel {main_channel_id}: {e}")
+                logger.error("Failed to send manual pot open announcement to channel %s: %s", main_channel_id, e)
     else:
-        await bot.send_message(chat_id=message.chat.id, text="❌ Failed to open a new pot. A pot for today might already exist or there was a DB error.", parse_mode=ParseMode.MARKDOWN)
-async def setpot_command(message: types.Message, state: FSMContext, db, admin_id, bot: Bot):
-    logger.info(f"Handler for /setpot called by {message.from_user.id}")
+        await bot.send_message(chat_id=chat_id, text="❌ Failed to open a new pot. A pot for today might already exist or there was a DB error.", parse_mode=ParseMode.MARKDOWN)
+
+async def openpot_command(message: types.Message, db, admin_id, bot: Bot, ist_timezone: pytz.BaseTzInfo, main_channel_id: int):
+    await _openpot(message.chat.id, message.from_user.id, db, admin_id, bot, ist_timezone, main_channel_id)
+
+async def _setpot(chat_id: int, user_id: int, state: FSMContext, db, admin_id, bot: Bot):
+    logger.info("Handler for /setpot called by %s", user_id)
     markup = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Set Max Users", callback_data="set_pot_limit")],
         [InlineKeyboardButton(text="Set Ticket Price", callback_data="set_pot_price")]
     ])
-    await bot.send_message(chat_id=message.chat.id, text="⚙️ What would you like to change about the pot settings?", reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
+    await bot.send_message(chat_id=chat_id, text="⚙️ What would you like to change about the pot settings?", reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
+
+async def setpot_command(message: types.Message, state: FSMContext, db, admin_id, bot: Bot):
+    await _setpot(message.chat.id, message.from_user.id, state, db, admin_id, bot)
+
 async def process_setpot_callback(call: types.CallbackQuery, state: FSMContext, db, admin_id):
-    logger.info(f"Executing process_setpot_callback logic for {call.from_user.id}")
+    logger.info("Executing process_setpot_callback logic for %s", call.from_user.id)
     await call.answer()
     await call.message.delete()
     if call.data == "set_pot_limit":
@@ -379,7 +440,7 @@ async def process_setpot_callback(call: types.CallbackQuery, state: FSMContext,
         await call.message.answer("💲 Please enter the new **ticket price** for the pot (e.g., `50`).", parse_mode=ParseMode.MARKDOWN)
         await state.set_state(AdminStates.SET_TICKET_PRICE)
 async def process_set_pot_limit(message: types.Message, state: FSMContext, db, admin_id, bot: Bot):
-    logger.info(f"Executing process_set_pot_limit logic for {message.from_user.id}")
+    logger.info("Executing process_set_pot_limit logic for %s", message.from_user.id)
     if db is None:
         await bot.send_message(chat_id=message.chat.id, text="Internal bot error. Please try again later.", parse_mode=ParseMode.MARKDOWN)
         await state.clear()
@@ -389,10 +450,10 @@ async def process_set_pot_limit(message: types.Message, state: FSMContext, db, a
         if new_limit <= 0:
             await bot.send_message(chat_id=message.chat.id, text="⛔️ Max users must be a positive number. Please try again.", parse_mode=ParseMode.MARKDOWN)
             return
-        ist_timezone = message.bot.get('ist_timezone')
-        current_pot = await get_current_pot(db, ist_timezone)
+        current_pot = await get_current_pot(db, IST_TIMEZONE)
         if current_pot and current_pot.get('status') != 'revealed':
             await db.pots.update_one({"_id": current_pot['_id']}, {"$set": {"max_users": new_limit}})
+            invalidate_pot_cache()
             await bot.send_message(chat_id=message.chat.id, text=f"✅ Max users for the current/next pot set to **{new_limit}**.", parse_mode=ParseMode.MARKDOWN)
         else:
             await bot.send_message(chat_id=message.chat.id, text=f"✅ Max users will be **{new_limit}** for the next pot creation. (No active pot to update directly).", parse_mode=ParseMode.MARKDOWN)
@@ -400,11 +461,11 @@ async def process_set_pot_limit(message: types.Message, state: FSMContext, db, a
     except ValueError:
         await bot.send_message(chat_id=message.chat.id, text="That's not a valid number. Please enter an integer for max users.", parse_mode=ParseMode.MARKDOWN)
     except Exception as e:
-        logger.error(f"Error in process_set_pot_limit: {e}", exc_info=True)
+        logger.error("Error in process_set_pot_limit: %s", e, exc_info=True)
         await bot.send_message(chat_id=message.chat.id, text=f"An error occurred: {e}", parse_mode=ParseMode.MARKDOWN)
         await state.clear()
 async def process_set_ticket_price(message: types.Message, state: FSMContext, db, admin_id, bot: Bot):
-    logger.info(f"Executing process_set_ticket_price logic for {message.from_user.id}")
+    logger.info("Executing process_set_ticket_price logic for %s", message.from_user.id)
     if db is None:
         await bot.send_message(chat_id=message.chat.id, text="Internal bot error. Please try again later.", parse_mode=ParseMode.MARKDOWN)
         await state.clear()
@@ -414,10 +475,10 @@ async def process_set_ticket_price(message: types.Message, state: FSMContext, db
         if new_price <= 0:
             await bot.send_message(chat_id=message.chat.id, text="⛔️ Ticket price must be a positive number. Please try again.", parse_mode=ParseMode.MARKDOWN)
             return
-        ist_timezone = message.bot.get('ist_timezone')
-        current_pot = await get_current_pot(db, ist_timezone)
+        current_pot = await get_current_pot(db, IST_TIMEZONE)
         if current_pot and current_pot.get('status') != 'revealed':
             await db.pots.update_one({"_id": current_pot['_id']}, {"$set": {"ticket_price": new_price}})
+            invalidate_pot_cache()
             await bot.send_message(chat_id=message.chat.id, text=f"✅ Ticket price for the current/next pot set to **₹{new_price:.2f}**.", parse_mode=ParseMode.MARKDOWN)
         else:
             await bot.send_message(chat_id=message.chat.id, text=f"✅ Ticket price will be **₹{new_price:.2f}** for the next pot creation. (No active pot to update directly).", parse_mode=ParseMode.MARKDOWN)
@@ -425,92 +486,136 @@ async def process_set_ticket_price(message: types.Message, state: FSMContext, db
     except ValueError:
         await bot.send_message(chat_id=message.chat.id, text="That's not a valid number. Please enter a numerical value for ticket price.", parse_mode=ParseMode.MARKDOWN)
     except Exception as e:
-        logger.error(f"Error in process_set_ticket_price: {e}", exc_info=True)
+        logger.error("Error in process_set_ticket_price: %s", e, exc_info=True)
         await bot.send_message(chat_id=message.chat.id, text=f"An error occurred: {e}", parse_mode=ParseMode.MARKDOWN)
         await state.clear()
-async def log_command(message: types.Message, db, admin_id, bot: Bot):
-    logger.info(f"Handler for /log called by {message.from_user.id}")
+def _user_csv_row(user):
+    get = user.get
+    return [
+        get('telegram_id'),
+        get('username', 'N/A'),
+        f"{get('real_balance', 0.0):.2f}",
+        f"{get('bonus_balance', 0.0):.2f}",
+        get('referral_code', 'N/A'),
+        get('referred_by', 'N/A'),
+        get('referral_count', 0),
+        get('joined_date') or 'N/A',
+        get('last_ticket_date') or 'N/A',
+        get('last_ticket_code', 'N/A'),
+        get('upi_id', 'N/A')
+    ]
+
+def _referral_csv_row(referrer):
+    return [
+        referrer.get('telegram_id'),
+        referrer.get('username', 'N/A'),
+        referrer.get('referral_code', 'N/A'),
+        referrer.get('referral_count', 0)
+    ]
+
+def _recharge_csv_row(recharge, users_by_id):
+    get = recharge.get
+    telegram_id = recharge['telegram_id']
+    return [
+        "Recharge",
+        telegram_id,
+        users_by_id.get(telegram_id, {}).get('username', 'N/A'),
+        f"{get('amount', 0.0):.2f}",
+        "Real",
+        get('timestamp') or 'N/A',
+        f"Order ID: {get('order_id', 'N/A')}, Status: {get('status', 'N/A')}"
+    ]
+
+def _pot_wallet_csv_row(row, users_by_id):
+    entry = row['entry']
+    entry_user = users_by_id.get(entry['telegram_id'])
+    end_time = row.get('end_time') or 'N/A'
+    if row['kind'] == "Payout":
+        # Only fall back to the user's current UPI ID when the winner entry has none recorded
+        winner_upi = entry.get('upi_id')
+        if winner_upi is None:
+            winner_upi = entry_user.get('upi_id', 'N/A') if entry_user else 'N/A'
+        return [
+            "Payout",
+            entry['telegram_id'],
+            entry_user.get('username', 'N/A') if entry_user else 'N/A',
+            f"{entry.get('prize', 0.0):.2f}",
+            "Real",
+            end_time,
+            f"Pot ID: {row['pot_id']}, Rank: {entry['rank']}, Ticket: {entry['ticket_code']}, UPI: {winner_upi}"
+        ]
+    participant_upi = entry_user.get('upi_id', 'N/A') if entry_user else 'N/A'
+    return [
+        "Refund",
+        entry['telegram_id'],
+        entry_user.get('username', 'N/A') if entry_user else 'N/A',
+        f"{row.get('ticket_price', 50.0):.2f}",
+        "Real",
+        end_time,
+        f"Pot ID: {row['pot_id']}, Reason: Less than 10 participants, UPI: {participant_upi}"
+    ]
+
+async def _batched(docs, size: int = CSV_BATCH_SIZE):
+    batch = []
+    async for doc in docs:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def _write_rows_off_loop(writer, docs, row_fn):
+    """Formats and writes CSV rows in a worker thread so large exports don't block the event loop."""
+    await asyncio.to_thread(writer.writerows, map(row_fn, docs))
+
+async def _stream_csv(writer, docs, row_fn):
+    async for batch in _batched(docs):
+        await _write_rows_off_loop(writer, batch, row_fn)
+
+async def _recording_users(users, users_by_id: dict):
+    """Passes users through while indexing them by telegram_id for the wallet CSV."""
+    async for user in users:
+        users_by_id[user['telegram_id']] = user
+        yield user
+
+async def _log(chat_id: int, user_id: int, db, admin_id, bot: Bot):
+    logger.info("Handler for /log called by %s", user_id)
     if db is None:
-        await bot.send_message(chat_id=message.chat.id, text="Internal bot error. Please try again later.", parse_mode=ParseMode.MARKDOWN)
+        await bot.send_message(chat_id=chat_id, text="Internal bot error. Please try again later.", parse_mode=ParseMode.MARKDOWN)
         return
-    users_data = await get_all_users(db)
-    users_csv_file = StringIO()
+    users_csv_file = _new_csv_text()
     users_writer = csv.writer(users_csv_file)
-    users_writer.writerow(["Telegram ID", "Username", "Real Balance", "Bonus Balance", "Referral Code", "Referred By", "Referral Count", "Joined Date", "Last Ticket Date", "Last Ticket Code", "UPI ID"])
-    for user in users_data:
-        users_writer.writerow([
-            user.get('telegram_id'),
-            user.get('username', 'N/A'),
-            f"{user.get('real_balance', 0.0):.2f}",
-            f"{user.get('bonus_balance', 0.0):.2f}",
-            user.get('referral_code', 'N/A'),
-            user.get('referred_by', 'N/A'),
-            user.get('referral_count', 0),
-            user.get('joined_date').strftime('%Y-%m-%d %H:%M:%S') if user.get('joined_date') else 'N/A',
-            user.get('last_ticket_date').strftime('%Y-%m-%d') if user.get('last_ticket_date') else 'N/A',
-            user.get('last_ticket_code', 'N/A'),
-            user.get('upi_id', 'N/A')
-        ])
-    users_csv_file.seek(0)
-    await bot.send_document(chat_id=message.chat.id, document=BufferedInputFile(users_csv_file.getvalue().encode(), filename="users_data.csv"), caption="👤 All User Data", parse_mode=ParseMode.MARKDOWN)
-    referrals_data = await get_all_referrals(db)
-    referrals_csv_file = StringIO()
+    users_writer.writerow(USERS_CSV_HEADER)
+    users_by_id = {}
+    referrals_csv_file = _new_csv_text()
     referrals_writer = csv.writer(referrals_csv_file)
-    referrals_writer.writerow(["Referrer Telegram ID", "Referrer Username", "Referral Code", "Number of Referrals"])
-    for referrer in referrals_data:
-        referrals_writer.writerow([
-            referrer.get('telegram_id'),
-            referrer.get('username', 'N/A'),
-            referrer.get('referral_code', 'N/A'),
-            referrer.get('referral_count', 0)
-        ])
-    referrals_csv_file.seek(0)
-    await bot.send_document(chat_id=message.chat.id, document=BufferedInputFile(referrals_csv_file.getvalue().encode(), filename="referrals_data.csv"), caption="🤝 Referral Data", parse_mode=ParseMode.MARKDOWN)
-    wallet_movements_csv_file = StringIO()
+    referrals_writer.writerow(REFERRALS_CSV_HEADER)
+    # The referrals export doesn't depend on the users map, so both cursors are drained together
+    await asyncio.gather(
+        _stream_csv(users_writer, _recording_users(iter_all_users(db, USERS_CSV_PROJECTION), users_by_id), _user_csv_row),
+        _stream_csv(referrals_writer, iter_all_referrals(db), _referral_csv_row)
+    )
+    wallet_movements_csv_file = _new_csv_text()
     wallet_writer = csv.writer(wallet_movements_csv_file)
-    wallet_writer.writerow(["Type", "User ID", "Username", "Amount", "Balance Type", "Timestamp", "Description/Order ID"])
-    for user in users_data:
-        if user.get('recharge_history'):
-            for recharge in user['recharge_history']:
-                wallet_writer.writerow([
-                    "Recharge",
-                    user['telegram_id'],
-                    user.get('username', 'N/A'),
-                    f"{recharge.get('amount', 0.0):.2f}",
-                    "Real",
-                    recharge.get('timestamp').strftime('%Y-%m-%d %H:%M:%S') if recharge.get('timestamp') else 'N/A',
-                    f"Order ID: {recharge.get('order_id', 'N/A')}, Status: {recharge.get('status', 'N/A')}"
-                ])
-    pots_data = await get_all_pots(db)
-    for pot in pots_data:
-        if pot.get('status') == 'revealed' and pot.get('winners'):
-            for winner in pot['winners']:
-                winner_user = await get_user(db, winner['telegram_id'])
-                winner_upi = winner.get('upi_id', winner_user.get('upi_id', 'N/A') if winner_user else 'N/A')
-                wallet_writer.writerow([
-                    "Payout",
-                    winner['telegram_id'],
-                    winner_user.get('username', 'N/A') if winner_user else 'N/A',
-                    f"{winner.get('prize', 0.0):.2f}",
-                    "Real",
-                    pot.get('end_time').strftime('%Y-%m-%d %H:%M:%S') if pot.get('end_time') else 'N/A',
-                    f"Pot ID: {str(pot['_id'])}, Rank: {winner['rank']}, Ticket: {winner['ticket_code']}, UPI: {winner_upi}"
-                ])
-        elif pot.get('status') == 'revealed' and pot.get('total_tickets', 0) < 10:
-            participants_in_pot = pot.get('participants', [])
-            ticket_price_refund = pot.get('ticket_price', 50.0)
-            for participant in participants_in_pot:
-                participant_user = await get_user(db, participant['telegram_id'])
-                participant_upi = participant_user.get('upi_id', 'N/A') if participant_user else 'N/A'
-                wallet_writer.writerow([
-                    "Refund",
-                    participant['telegram_id'],
-                    participant_user.get('username', 'N/A') if participant_user else 'N/A',
-                    f"{ticket_price_refund:.2f}",
-                    "Real",
-                    pot.get('end_time').strftime('%Y-%m-%d %H:%M:%S') if pot.get('end_time') else 'N/A',
-                    f"Pot ID: {str(pot['_id'])}, Reason: Less than 10 participants, UPI: {participant_upi}"
-                ])
-    wallet_movements_csv_file.seek(0)
-    await bot.send_document(chat_id=message.chat.id, document=BufferedInputFile(wallet_movements_csv_file.getvalue().encode(), filename="wallet_movements.csv"), caption="💸 Wallet Movement Log", parse_mode=ParseMode.MARKDOWN)
-    await bot.send_message(chat_id=message.chat.id, text="✅ Log files generated and sent!", parse_mode=ParseMode.MARKDOWN)
\ No newline at end of file
+    wallet_writer.writerow(WALLET_CSV_HEADER)
+    # Pot payouts/refunds go to their own buffer so both cursors can be drained together;
+    # it's appended after the recharges to keep the log's row order
+    pot_entries_csv_file = _new_csv_text()
+    await asyncio.gather(
+        _stream_csv(wallet_writer, iter_all_recharges(db, RECHARGES_CSV_PROJECTION), partial(_recharge_csv_row, users_by_id=users_by_id)),
+        _stream_csv(csv.writer(pot_entries_csv_file), iter_pot_wallet_entries(db), partial(_pot_wallet_csv_row, users_by_id=users_by_id))
+    )
+    pot_entries_csv_file.flush()
+    wallet_movements_csv_file.flush()
+    wallet_movements_csv_file.buffer.write(pot_entries_csv_file.detach().getvalue())
+    await asyncio.gather(
+        bot.send_document(chat_id=chat_id, document=_csv_document(users_csv_file, "users_data.csv"), caption="👤 All User Data", parse_mode=ParseMode.MARKDOWN),
+        bot.send_document(chat_id=chat_id, document=_csv_document(referrals_csv_file, "referrals_data.csv"), caption="🤝 Referral Data", parse_mode=ParseMode.MARKDOWN),
+        bot.send_document(chat_id=chat_id, document=_csv_document(wallet_movements_csv_file, "wallet_movements.csv"), caption="💸 Wallet Movement Log", parse_mode=ParseMode.MARKDOWN)
+    )
+    await bot.send_message(chat_id=chat_id, text="✅ Log files generated and sent!", parse_mode=ParseMode.MARKDOWN)
+
+async def log_command(message: types.Message, db, admin_id, bot: Bot):
+    await _log(message.chat.id, message.from_user.id, db, admin_id, bot)
+
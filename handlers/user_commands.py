@@ -1,4 +1,5 @@
 import os
+import asyncio
 from datetime import datetime, time, timedelta
 import random
 import logging
@@ -6,6 +7,7 @@ import pytz
 import re
 from functools import wraps
 from io import BytesIO
+from time import monotonic
 
 from aiogram import Router, types, F, Bot
 from aiogram.fsm.context import FSMContext
@@ -18,19 +20,19 @@ logger = logging.getLogger(__name__)
 
 from bot_config import (
     CASHFREE_RECHARGE_LINK, MIN_RECHARGE_AMOUNT, REFERRAL_BONUS,
-    REVEAL_DELAY_MINUTES, ADMIN_ID, IST_TIMEZONE
+    REVEAL_DELAY_MINUTES, IST_TIMEZONE
 )
 from db.db_access import (
-    get_user, create_user, update_user_balance, add_user_to_pot,
-    update_user_ticket, check_referred_user_ticket_status,
+    get_user, create_user, add_user_to_pot,
+    check_referred_user_ticket_status,
     mark_referred_user_ticket_bought, increment_referral_count, update_user_upi,
     add_recharge_to_history, get_user_counts_by_referral_source, get_pending_payout_for_user,
-    get_available_tickets, purchase_ticket_atomically, get_pending_recharge_for_user,
+    get_available_tickets, purchase_ticket, get_pending_recharge_for_user,
     get_referred_users_details
 )
 from utils.ticket import generate_unique_ticket_code, generate_ticket_image
 from utils.pot import get_current_pot_status, get_current_pot
-from utils.helpers import escape_markdown_v2
+from utils.helpers import escape_markdown_v2, spawn
 
 class ChannelJoinStates(StatesGroup):
     WAITING_FOR_CHANNEL_JOIN = State()
@@ -43,17 +45,128 @@ class UserStates(StatesGroup):
     CHOOSING_BONUS = State()
 
 
+WELCOME_MESSAGE = (
+    "👋 Welcome to **LuckyDrop Bot**, where daily drops can make your day! 🤑\n\n"
+    "Here's how to play:\n"
+    "✨ We have one daily pot from **5:00 PM to 7:00 PM IST**.\n"
+    "🎟️ Buy a ticket for ₹50. **Max one ticket per user per pot!**\n"
+    "🍀 Each ticket has a **unique 6-digit code**.\n"
+    "💰 Tickets are bought using up to ₹30 bonus + ₹20 real balance.\n"
+    "🏅 After **7:00 PM IST**, winners are chosen randomly from all **sold tickets** and the full prize pool is awarded if we hit 30 users:\n"
+    "   🥇 1st: ₹500\n"
+    "   🥈 2nd: ₹200\n"
+    "   🥉 3rd: ₹100\n"
+    "📉 If 10-29 users, prizes scale proportionally. If <10, all refunds!\n"
+    "💸 **Winners get paid to their UPI ID within 12 hours of results!**\n\n"
+    "Use these commands:\n"
+    "/wallet — Check your balance and recharge\n"
+    "/buyticket — Grab your lucky ticket\n"
+    "/refer — Share the luck & earn bonuses\n"
+    "/pot — See the current pot's status\n"
+    "/setupi — Register or update your UPI ID\n"
+    "/help — Get a quick reminder on how to play\n\n"
+    "Good luck, future winner! 🚀"
+)
+
+HELP_TEXT = (
+    "🤔 **How to Play LuckyDrop Bot:**\n\n"
+    "1.  **Daily Pot:** A new lottery pot opens every day from **5:00 PM to 7:00 PM IST**. 🕰️\n"
+    "2.  **Buy a Ticket:** Use `/buyticket` to purchase your lucky entry. Each ticket costs **₹50**. "
+    "You can use up to **₹30 from your bonus balance** and the rest from your real balance. **Only one ticket per user per pot!**\n"
+    "3.  **Unique Code:** Every ticket has a **unique 6-digit code**.\n"
+    "4.  **Wallet:** Check your `real_balance` and `bonus_balance` with `/wallet`. Recharge your real balance manually by paying via the Cashfree link and submitting your payment details for admin approval.\n"
+    "5.  **Refer & Earn:** Share your unique referral link (get it with `/refer`). When a friend joins via your link, "
+    "starts the bot, and buys their first ticket, you get a **₹10 bonus!** 🤝\n"
+    "6.  **Pot Status:** See how many tickets are sold with `/pot`.\n"
+    "7.  **UPI Payouts:** Winners get paid directly to their UPI ID. Use `/setupi` to register or update your UPI ID. **Payouts are processed within 12 hours of results!**\n\n"
+    "🏆 **Winning Rules (Draw after 7:00 PM IST):**\n"
+    "-   **Less than 10 users:** Everyone gets a full refund to their **real** wallet. No hard feelings! ↩️\n"
+    "-   **10 to 29 users:** Prizes scale proportionally. If you want to know more about the scaled prizes read the previous logs\n"
+    "-   **30 users (Full Pot):**\n"
+    "   🥇 1st Prize: ₹500\n"
+    "   🥈 2nd: ₹200\n"
+    "   🥉 3rd: ₹100\n\n"
+    "Winners are chosen **fairly and randomly from all SOLD tickets** by the system and announced automatically shortly after the pot closes. Keep an eye out! 👀\n\n"
+    "Got it? Let's get lucky! ✨"
+)
+
+UPI_ID_RE = re.compile(r"^[\w.\-]{2,}@[a-zA-Z]{2,}$")
+
+MEMBERSHIP_CACHE_TTL_SECONDS = 120.0
+MEMBERSHIP_CACHE_MAX_ENTRIES = 50000
+# (user_id, channel_id) -> monotonic expiry. Only confirmed memberships are cached so a user
+# who has just joined is re-checked straight away when they press "I have joined!".
+_membership_cache = {}
+
 async def is_user_member_of_channel(bot: Bot, user_id: int, channel_id: int) -> bool:
+    key = (user_id, channel_id)
+    expires_at = _membership_cache.get(key)
+    if expires_at is not None:
+        if expires_at > monotonic():
+            return True
+        del _membership_cache[key]
     try:
         chat_member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-        return chat_member.status in ['creator', 'administrator', 'member', 'restricted']
+        is_member = chat_member.status in ['creator', 'administrator', 'member', 'restricted']
+        if is_member:
+            if len(_membership_cache) >= MEMBERSHIP_CACHE_MAX_ENTRIES:
+                # Dicts keep insertion order, so this drops the oldest entry
+                del _membership_cache[next(iter(_membership_cache))]
+            _membership_cache[key] = monotonic() + MEMBERSHIP_CACHE_TTL_SECONDS
+        return is_member
     except Exception as e:
-        logger.error(f"Error checking channel membership for user {user_id} in channel {channel_id}: {e}")
+        logger.error("Error checking channel membership for user %s in channel %s: %s", user_id, channel_id, e)
         return False
 
 
+# channel_id -> join link. A channel's invite link/username doesn't change while the bot runs.
+_channel_link_cache = {}
+
+async def get_channel_link(bot: Bot, channel_id: int):
+    """Returns the channel's invite link (or public t.me link), or None if neither is available."""
+    link = _channel_link_cache.get(channel_id)
+    if link is not None:
+        return link
+    try:
+        channel_info = await bot.get_chat(channel_id)
+    except Exception as e:
+        logger.error("Failed to fetch channel info for %s: %s", channel_id, e)
+        return None
+    if channel_info.invite_link:
+        link = channel_info.invite_link
+    elif channel_info.username:
+        link = f"https://t.me/{channel_info.username}"
+    else:
+        logger.warning("Could not get invite link or username for channel %s", channel_id)
+        return None
+    _channel_link_cache[channel_id] = link
+    return link
+
+
+async def prompt_channel_join(send, bot: Bot, main_channel_id: int, state: FSMContext):
+    """Asks the user to join the main channel. `send` is message.reply or call.message.edit_text."""
+    valid_channel_link = await get_channel_link(bot, main_channel_id)
+
+    if valid_channel_link:
+        markup = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Join Our Official Channel 🎉", url=valid_channel_link)],
+            [InlineKeyboardButton(text="I have joined! ✅", callback_data="check_channel_membership")]
+        ])
+        await send(
+            "🛑 **Important!** To use LuckyDrop Bot, you must first join our official Telegram channel for important updates, results, and announcements!\n\n"
+            "Please click the button below to join:",
+            reply_markup=markup
+        )
+    else:
+        await send(
+            "🛑 Not yet! Please join the channel first to unlock all features.\n"
+            "Unfortunately, I couldn't get a direct link. Please search for the channel manually by its name/username and join. Then click 'I have joined!' again."
+        )
+    await state.set_state(ChannelJoinStates.WAITING_FOR_CHANNEL_JOIN)
+
+
 async def check_channel_membership(call: types.CallbackQuery, state: FSMContext, db, admin_id, main_channel_id, ist_timezone):
-    logger.info(f"Checking channel membership for user {call.from_user.id} via callback.")
+    logger.info("Checking channel membership for user %s via callback.", call.from_user.id)
     user_id = call.from_user.id
 
     if not main_channel_id:
@@ -75,13 +188,13 @@ async def check_channel_membership(call: types.CallbackQuery, state: FSMContext,
                 referrer_user = await get_user(db, referrer_id)
                 if referrer_user and referrer_user['telegram_id'] != user_id:
                     await create_user(db, user_id, call.from_user.username, referrer_id)
-                    logger.info(f"New user {user_id} created after channel join with referrer: {referrer_id}")
+                    logger.info("New user %s created after channel join with referrer: %s", user_id, referrer_id)
                 else:
                     await create_user(db, user_id, call.from_user.username, None)
-                    logger.info(f"New user {user_id} created after channel join (invalid referrer).")
+                    logger.info("New user %s created after channel join (invalid referrer).", user_id)
             else:
                 await create_user(db, user_id, call.from_user.username, None)
-                logger.info(f"New user {user_id} created after channel join (no referrer).")
+                logger.info("New user %s created after channel join (no referrer).", user_id)
 
         # FIX: Do not clear state here. The second /start command will handle it.
         # await state.clear() is removed.
@@ -89,41 +202,14 @@ async def check_channel_membership(call: types.CallbackQuery, state: FSMContext,
         await call.answer("Welcome aboard!")
 
     else:
-        valid_channel_link = None
-        try:
-            channel_info = await call.bot.get_chat(main_channel_id)
-            valid_channel_link = channel_info.invite_link or f"https://t.me/{channel_info.username}"
-            if not channel_info.username and not channel_info.invite_link:
-                valid_channel_link = None
-                logger.warning(f"Could not get invite link or username for channel {main_channel_id}")
-        except Exception as e:
-            channel_link = "Error fetching channel link. Please contact support."
-            logger.error(f"Failed to fetch channel info for {main_channel_id} during callback: {e}")
-            valid_channel_link = None
-
-        if valid_channel_link:
-            markup = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Join Our Official Channel 🎉", url=valid_channel_link)],
-                [InlineKeyboardButton(text="I have joined! ✅", callback_data="check_channel_membership")]
-            ])
-            await call.message.edit_text(
-                "🛑 **Important!** To use LuckyDrop Bot, you must first join our official Telegram channel for important updates, results, and announcements!\n\n"
-                "Please click the button below to join:",
-                reply_markup=markup
-            )
-        else:
-            await call.message.edit_text(
-                "🛑 Not yet! Please join the channel first to unlock all features.\n"
-                "Unfortunately, I couldn't get a direct link. Please search for the channel manually by its name/username and join. Then click 'I have joined!' again."
-            )
-        await state.set_state(ChannelJoinStates.WAITING_FOR_CHANNEL_JOIN)
+        await prompt_channel_join(call.message.edit_text, call.bot, main_channel_id, state)
         return
 
     await call.answer()
 
 
 async def start_command(message: types.Message, state: FSMContext, db, admin_id, main_channel_id, ist_timezone):
-    logger.info(f"Handler for /start called by {message.from_user.id}. Message text: {message.text}")
+    logger.info("Handler for /start called by %s. Message text: %s", message.from_user.id, message.text)
     # FIX: Move state clearing to the end of a successful start
 
     if db is None or main_channel_id is None:
@@ -136,7 +222,7 @@ async def start_command(message: types.Message, state: FSMContext, db, admin_id,
     is_member = await is_user_member_of_channel(message.bot, user_id, main_channel_id)
 
     if not is_member:
-        logger.info(f"User {user_id} is not a member of the main channel. Prompting to join.")
+        logger.info("User %s is not a member of the main channel. Prompting to join.", user_id)
 
         referrer_id = None
         args = message.text.split(maxsplit=1)
@@ -146,69 +232,16 @@ async def start_command(message: types.Message, state: FSMContext, db, admin_id,
             if referrer_user and referrer_user['telegram_id'] != user_id:
                 referrer_id = referrer_user['telegram_id']
                 await state.update_data(pending_referrer_id=referrer_id)
-                logger.info(f"Referral code {referrer_code} saved to state for user {user_id}.")
-
-        valid_channel_link = None
-        try:
-            channel_info = await message.bot.get_chat(main_channel_id)
-            valid_channel_link = channel_info.invite_link or f"https://t.me/{channel_info.username}"
-            if not channel_info.username and not channel_info.invite_link:
-                valid_channel_link = None
-                logger.warning(f"Could not get invite link or username for channel {main_channel_id}")
-        except Exception as e:
-            channel_link = "Error fetching channel link. Please contact support."
-            logger.error(f"Failed to fetch channel info for {main_channel_id} during callback: {e}")
-            valid_channel_link = None
-
-        if valid_channel_link:
-            markup = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Join Our Official Channel 🎉", url=valid_channel_link)],
-                [InlineKeyboardButton(text="I have joined! ✅", callback_data="check_channel_membership")]
-            ])
-            await message.reply(
-                "🛑 **Important!** To use LuckyDrop Bot, you must first join our official Telegram channel for important updates, results, and announcements!\n\n"
-                "Please click the button below to join:",
-                reply_markup=markup
-            )
-        else:
-            await message.reply(
-                "🛑 Not yet! Please join the channel first to unlock all features.\n"
-                "Unfortunately, I couldn't get a direct link. Please search for the channel manually by its name/username and join. Then click 'I have joined!' again."
-            )
-        await state.set_state(ChannelJoinStates.WAITING_FOR_CHANNEL_JOIN)
-        return
-
-    user = await get_user(db, user_id)
+                logger.info("Referral code %s saved to state for user %s.", referrer_code, user_id)
 
-    welcome_message = (
-        "👋 Welcome to **LuckyDrop Bot**, where daily drops can make your day! 🤑\n\n"
-        "Here's how to play:\n"
-        "✨ We have one daily pot from **5:00 PM to 7:00 PM IST**.\n"
-        "🎟️ Buy a ticket for ₹50. **Max one ticket per user per pot!**\n"
-        "🍀 Each ticket has a **unique 6-digit code**.\n"
-        "💰 Tickets are bought using up to ₹30 bonus + ₹20 real balance.\n"
-        "🏅 After **7:00 PM IST**, winners are chosen randomly from all **sold tickets** and the full prize pool is awarded if we hit 30 users:\n"
-        "   🥇 1st: ₹500\n"
-        "   🥈 2nd: ₹200\n"
-        "   🥉 3rd: ₹100\n"
-        "📉 If 10-29 users, prizes scale proportionally. If <10, all refunds!\n"
-        "💸 **Winners get paid to their UPI ID within 12 hours of results!**\n\n"
-        "Use these commands:\n"
-        "/wallet — Check your balance and recharge\n"
-        "/buyticket — Grab your lucky ticket\n"
-        "/refer — Share the luck & earn bonuses\n"
-        "/pot — See the current pot's status\n"
-        "/setupi — Register or update your UPI ID\n"
-        "/help — Get a quick reminder on how to play\n\n"
-        "Good luck, future winner! 🚀"
-    )
+        await prompt_channel_join(message.reply, message.bot, main_channel_id, state)
+        return
 
-    if not user:
+    if not await get_user(db, user_id, {"_id": 1}):
         await create_user(db, user_id, message.from_user.username, None)
-        user = await get_user(db, user_id)
-        logger.info(f"New user {user_id} created from regular /start command (already a member).")
+        logger.info("New user %s created from regular /start command (already a member).", user_id)
 
-    await message.reply(welcome_message)
+    await message.reply(WELCOME_MESSAGE)
     # FIX: Clear state only after the entire successful start flow is complete
     await state.clear()
 
@@ -222,7 +255,7 @@ def check_channel_membership_decorator(func):
         ist_timezone = kwargs.get('ist_timezone')
 
         if db is None or main_channel_id is None:
-            logger.error(f"Config error in {func.__name__} decorator: db or main_channel_id missing.")
+            logger.error("Config error in %s decorator: db or main_channel_id missing.", func.__name__)
             await message.reply("Bot configuration error. Please contact support.")
             return
 
@@ -230,7 +263,7 @@ def check_channel_membership_decorator(func):
         is_member = await is_user_member_of_channel(message.bot, user_id, main_channel_id)
 
         if not is_member:
-            logger.info(f"User {user_id} tried {message.text} but is not a channel member. Prompting to join.")
+            logger.info("User %s tried %s but is not a channel member. Prompting to join.", user_id, message.text)
 
             referrer_id = None
             args = message.text.split(maxsplit=1)
@@ -240,31 +273,9 @@ def check_channel_membership_decorator(func):
                 if referrer_user and referrer_user['telegram_id'] != user_id:
                     referrer_id = referrer_user['telegram_id']
                     await state.update_data(pending_referrer_id=referrer_id)
-                    logger.info(f"Referral code {referrer_code} saved to state for user {user_id}.")
+                    logger.info("Referral code %s saved to state for user %s.", referrer_code, user_id)
 
-            valid_channel_link = None
-            try:
-                channel_info = await message.bot.get_chat(main_channel_id)
-                valid_channel_link = channel_info.invite_link or f"https://t.me/{channel_info.username}"
-            except Exception:
-                valid_channel_link = "Error fetching channel link. Please contact support."
-
-            if valid_channel_link and not valid_channel_link.startswith("Error fetching"):
-                markup = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="Join Our Official Channel 🎉", url=valid_channel_link)],
-                    [InlineKeyboardButton(text="I have joined! ✅", callback_data="check_channel_membership")]
-                ])
-                await message.reply(
-                    "🛑 **Important!** To use LuckyDrop Bot, you must first join our official Telegram channel for important updates, results, and announcements!\n\n"
-                    "Please click the button below to join:",
-                    reply_markup=markup
-                )
-            else:
-                await message.reply(
-                    "🛑 Not yet! Please join the channel first to unlock all features.\n"
-                    "Unfortunately, I couldn't get a direct link. Please search for the channel manually by its name/username and join. Then click 'I have joined!' again."
-                )
-            await state.set_state(ChannelJoinStates.WAITING_FOR_CHANNEL_JOIN)
+            await prompt_channel_join(message.reply, message.bot, main_channel_id, state)
             return
 
         kwargs['ist_timezone'] = ist_timezone
@@ -273,7 +284,7 @@ def check_channel_membership_decorator(func):
 
 
 async def wallet_command(message: types.Message, db, admin_id, main_channel_id, ist_timezone):
-    logger.info(f"Handler for /wallet called by {message.from_user.id}")
+    logger.info("Handler for /wallet called by %s", message.from_user.id)
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.reply("Looks like you're new here! Please use /start to register. 🤖")
@@ -303,7 +314,7 @@ async def wallet_command(message: types.Message, db, admin_id, main_channel_id,
 
 
 async def recharge_status_command(message: types.Message, db, admin_id, main_channel_id, ist_timezone):
-    logger.info(f"Handler for /recharge_status called by {message.from_user.id}")
+    logger.info("Handler for /recharge_status called by %s", message.from_user.id)
     pending_recharge = await get_pending_recharge_for_user(db, message.from_user.id)
 
     response_message = "✅ You have no pending recharge requests. Use /wallet to recharge your balance."
@@ -320,7 +331,7 @@ async def recharge_status_command(message: types.Message, db, admin_id, main_cha
 
 async def recharge_status_callback(call: types.CallbackQuery, db, admin_id, main_channel_id, ist_timezone):
     await call.answer()
-    logger.info(f"Handler for recharge_status_check callback called by {call.from_user.id}")
+    logger.info("Handler for recharge_status_check callback called by %s", call.from_user.id)
 
     pending_recharge = await get_pending_recharge_for_user(db, call.from_user.id)
 
@@ -382,12 +393,12 @@ async def process_recharge_details(message: types.Message, state: FSMContext, db
     except ValueError:
         await message.reply("❌ Invalid format. Please make sure you enter your details on three separate lines as instructed.")
     except Exception as e:
-        logger.error(f"Error processing recharge details from user {user_id}: {e}", exc_info=True)
+        logger.error("Error processing recharge details from user %s: %s", user_id, e, exc_info=True)
         await message.reply("An unexpected error occurred. Please try again.")
         await state.clear()
 
 async def buyticket_command(message: types.Message, db, admin_id, main_channel_id, ist_timezone, state: FSMContext):
-    logger.info(f"Handler for /buyticket called by {message.from_user.id}")
+    logger.info("Handler for /buyticket called by %s", message.from_user.id)
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.reply("Please use /start to register before buying a ticket. 🚀")
@@ -520,7 +531,17 @@ async def process_bonus_selection_and_buy(call: types.CallbackQuery, state: FSMC
         await state.clear()
         return
 
-    purchase_success = await purchase_ticket_atomically(db, current_pot['_id'], user_id, ticket_code)
+    referrer_id = user.get('referred_by')
+    purchase_success, referrer_credited, tickets_sold = await purchase_ticket(
+        db, current_pot['_id'], user_id, ticket_code,
+        real_amount=real_needed, bonus_amount=bonus_to_use,
+        referrer_id=referrer_id, referral_bonus=REFERRAL_BONUS
+    )
+
+    if purchase_success is None:
+        await call.message.edit_text("💸 Your balance changed and no longer covers this ticket. Please check /wallet and try again.")
+        await state.clear()
+        return
 
     if not purchase_success:
         await call.message.edit_text(f"Oh no! Ticket `{ticket_code}` was just sold. Please choose another ticket from the list below.")
@@ -528,45 +549,26 @@ async def process_bonus_selection_and_buy(call: types.CallbackQuery, state: FSMC
         await buyticket_command(call.message, db, admin_id, main_channel_id, ist_timezone, state)
         return
 
-    await update_user_balance(db, user_id, real_amount=-real_needed, bonus_amount=-bonus_to_use)
-    await update_user_ticket(db, user_id, ticket_code)
-
-    referrer_id = user.get('referred_by')
-    if referrer_id:
-        referrer_user = await get_user(db, referrer_id)
-
-        if referrer_user and user_id not in referrer_user.get('referred_users_tickets', []):
-
-            logger.info(f"User {user_id} is buying their first ticket. Crediting referrer {referrer_id} with bonus...")
+    if referrer_credited:
+        logger.info("User %s bought their first ticket. Referrer %s credited with bonus.", user_id, referrer_id)
+        # Runs alongside the ticket image below instead of delaying the buyer's confirmation
+        spawn(_notify_referrer_bonus(call.bot, db, referrer_id))
+    elif referrer_id:
+        logger.info("User %s has already been credited for a previous ticket purchase. No bonus awarded.", user_id)
 
-            await db.users.update_one(
-                {"telegram_id": referrer_id},
-                {"$inc": {"bonus_balance": REFERRAL_BONUS, "referral_count": 1},
-                 "$push": {"referred_users_tickets": user_id}}
-            )
-
-            try:
-                updated_referrer = await get_user(db, referrer_id)
-                referrer_balance = updated_referrer.get('bonus_balance', 0.0)
-                await call.bot.send_message(
-                    referrer_id,
-                    f"🎉 **Referral Bonus Alert!** 🎉\n"
-                    f"Your friend has bought their first ticket! You have been credited with a **₹{REFERRAL_BONUS:.2f} bonus!**\n"
-                    f"Your new bonus balance is ₹{referrer_balance:.2f}. Keep referring to earn more! 🤝"
-                )
-                logger.info(f"Bonus of {REFERRAL_BONUS} credited to referrer {referrer_id}.")
-            except Exception as e:
-                logger.error(f"Failed to notify referrer {referrer_id} about bonus: {e}")
-        else:
-            logger.info(f"User {user_id} has already been credited for a previous ticket purchase. No bonus awarded.")
+    # The count comes back from the purchase itself, so exactly one buyer sees the pot fill up
+    max_users = current_pot.get('max_users', 30)
+    if tickets_sold == max_users:
+        spawn(call.bot.send_message(admin_id, f"🔔 **ATTENTION ADMIN!** The pot is now FULL! ({tickets_sold}/{max_users} users)."))
 
     try:
         user_id_str = str(user.get('telegram_id'))
-        image_path = generate_ticket_image(code=ticket_code, user_id=user_id_str, referral_name=None)
+        # Pillow rendering is CPU-bound; keep it off the event loop
+        image_path = await asyncio.to_thread(generate_ticket_image, code=ticket_code, user_id=user_id_str, referral_name=None)
 
-        if image_path and os.path.exists(image_path):
+        if image_path and await asyncio.to_thread(os.path.exists, image_path):
             await call.message.answer_photo(photo=FSInputFile(image_path))
-            os.remove(image_path)
+            await asyncio.to_thread(os.remove, image_path)
 
         await call.message.answer(
             f"🎉 **CONGRATULATIONS!** 🎉\n"
@@ -575,7 +577,7 @@ async def process_bonus_selection_and_buy(call: types.CallbackQuery, state: FSMC
             parse_mode='Markdown'
         )
     except Exception as e:
-        logger.error(f"Error during image generation for user {user_id}: {e}", exc_info=True)
+        logger.error("Error during image generation for user %s: %s", user_id, e, exc_info=True)
         await call.message.edit_text(
             f"🎉 Success! You've got your lucky ticket for today! 🎉\n"
             f"Your ticket code: `{ticket_code}`\n"
@@ -584,13 +586,22 @@ async def process_bonus_selection_and_buy(call: types.CallbackQuery, state: FSMC
             parse_mode='Markdown'
         )
 
+    await state.clear()
 
-    filled_count = len(current_pot.get('participants', [])) + 1
-    max_users = current_pot.get('max_users', 30)
-    if filled_count == max_users:
-        await call.bot.send_message(admin_id, f"🔔 **ATTENTION ADMIN!** The pot is now FULL! ({filled_count}/{max_users} users).")
 
-    await state.clear()
+async def _notify_referrer_bonus(bot: Bot, db, referrer_id: int):
+    try:
+        updated_referrer = await get_user(db, referrer_id)
+        referrer_balance = updated_referrer.get('bonus_balance', 0.0)
+        await bot.send_message(
+            referrer_id,
+            f"🎉 **Referral Bonus Alert!** 🎉\n"
+            f"Your friend has bought their first ticket! You have been credited with a **₹{REFERRAL_BONUS:.2f} bonus!**\n"
+            f"Your new bonus balance is ₹{referrer_balance:.2f}. Keep referring to earn more! 🤝"
+        )
+        logger.info("Bonus of %s credited to referrer %s.", REFERRAL_BONUS, referrer_id)
+    except Exception as e:
+        logger.error("Failed to notify referrer %s about bonus: %s", referrer_id, e)
 
 
 async def handle_sold_ticket_click(call: types.CallbackQuery):
@@ -598,7 +609,7 @@ async def handle_sold_ticket_click(call: types.CallbackQuery):
 
 
 async def refer_command(message: types.Message, db, admin_id, main_channel_id, ist_timezone):
-    logger.info(f"Handler for /refer called by {message.from_user.id}")
+    logger.info("Handler for /refer called by %s", message.from_user.id)
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.reply("Please use /start to register first. 🤖")
@@ -636,7 +647,7 @@ async def refer_command(message: types.Message, db, admin_id, main_channel_id, i
 
 
 async def pot_command(message: types.Message, db, admin_id, main_channel_id, ist_timezone):
-    logger.info(f"Handler for /pot called by {message.from_user.id}")
+    logger.info("Handler for /pot called by %s", message.from_user.id)
     current_pot = await get_current_pot(db, ist_timezone)
 
     if not current_pot:
@@ -648,33 +659,12 @@ async def pot_command(message: types.Message, db, admin_id, main_channel_id, ist
 
 
 async def help_command(message: types.Message, db, admin_id, main_channel_id, ist_timezone):
-    logger.info(f"Handler for /help called by {message.from_user.id}")
-    help_text = (
-        "🤔 **How to Play LuckyDrop Bot:**\n\n"
-        "1.  **Daily Pot:** A new lottery pot opens every day from **5:00 PM to 7:00 PM IST**. 🕰️\n"
-        "2.  **Buy a Ticket:** Use `/buyticket` to purchase your lucky entry. Each ticket costs **₹50**. "
-        "You can use up to **₹30 from your bonus balance** and the rest from your real balance. **Only one ticket per user per pot!**\n"
-        "3.  **Unique Code:** Every ticket has a **unique 6-digit code**.\n"
-        "4.  **Wallet:** Check your `real_balance` and `bonus_balance` with `/wallet`. Recharge your real balance manually by paying via the Cashfree link and submitting your payment details for admin approval.\n"
-        "5.  **Refer & Earn:** Share your unique referral link (get it with `/refer`). When a friend joins via your link, "
-        "starts the bot, and buys their first ticket, you get a **₹10 bonus!** 🤝\n"
-        "6.  **Pot Status:** See how many tickets are sold with `/pot`.\n"
-        "7.  **UPI Payouts:** Winners get paid directly to their UPI ID. Use `/setupi` to register or update your UPI ID. **Payouts are processed within 12 hours of results!**\n\n"
-        "🏆 **Winning Rules (Draw after 7:00 PM IST):**\n"
-        "-   **Less than 10 users:** Everyone gets a full refund to their **real** wallet. No hard feelings! ↩️\n"
-        "-   **10 to 29 users:** Prizes scale proportionally. If you want to know more about the scaled prizes read the previous logs\n"
-        "-   **30 users (Full Pot):**\n"
-        "   🥇 1st Prize: ₹500\n"
-        "   🥈 2nd: ₹200\n"
-        "   🥉 3rd: ₹100\n\n"
-        "Winners are chosen **fairly and randomly from all SOLD tickets** by the system and announced automatically shortly after the pot closes. Keep an eye out! 👀\n\n"
-        "Got it? Let's get lucky! ✨"
-    )
-    await message.reply(help_text)
+    logger.info("Handler for /help called by %s", message.from_user.id)
+    await message.reply(HELP_TEXT)
 
 
 async def setupi_command(message: types.Message, state: FSMContext, db, admin_id, main_channel_id, ist_timezone):
-    logger.info(f"Handler for /setupi called by {message.from_user.id}")
+    logger.info("Handler for /setupi called by %s", message.from_user.id)
     user = await get_user(db, message.from_user.id)
     if not user:
         await message.reply("Please use /start to register first. 🤖")
@@ -695,7 +685,7 @@ async def process_upi_input(message: types.Message, state: FSMContext, db, admin
     user_id = message.from_user.id
     upi_id_raw = message.text.strip()
 
-    if not re.match(r"^[\w.\-]{2,}@[a-zA-Z]{2,}$", upi_id_raw):
+    if not UPI_ID_RE.match(upi_id_raw):
         await message.reply("That doesn't look like a valid UPI ID format. Please try again.\n"
                              "Example: `yourname@bank` or `phonenumber@upi`\n"
                              "Make sure it contains an `@` symbol and a dot (`.`) in the domain part.", parse_mode='Markdown')
@@ -744,11 +734,11 @@ async def confirm_upi_callback(call: types.CallbackQuery, state: FSMContext, db,
                 )
                 await call.bot.send_message(admin_id, admin_message, parse_mode='Markdown')
             except Exception as e:
-                logger.error(f"Failed to notify admin about UPI update for winner {user_id}: {e}")
+                logger.error("Failed to notify admin about UPI update for winner %s: %s", user_id, e)
 
         await call.message.edit_text(f"🎉 Your UPI ID has been set to: `{escape_markdown_v2(new_upi_id)}`\n"
                                      "You're all set for payouts! 💰", parse_mode='Markdown')
-        logger.info(f"User {user_id} confirmed and set UPI ID: {new_upi_id}")
+        logger.info("User %s confirmed and set UPI ID: %s", user_id, new_upi_id)
     else:
         await call.message.edit_text("UPI ID not confirmed. Please send your UPI ID again if you wish to set it.")
         await state.set_state(UserStates.WAITING_FOR_UPI_ID)
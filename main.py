@@ -14,16 +14,20 @@ from aiogram.enums import ParseMode
 from aiogram.types import BotCommand
 from aiogram.client.default import DefaultBotProperties
 
-from motor.motor_asyncio import AsyncIOMotorClient
 from aiohttp import web
 
+try:
+    import uvloop
+except ImportError:  # optional speed-up; not available on Windows
+    uvloop = None
+
 # Import config settings
 from bot_config import (
-    BOT_TOKEN, ADMIN_ID, MONGO_URI, MAIN_CHANNEL_ID, ADMIN_SECRET_CODE,
-    IST_TIMEZONE, UTC_TIMEZONE
+    CONFIG, IST_TIMEZONE, UTC_TIMEZONE
 )
 
 # Import other modules from new locations
+from db.client import get_client
 from db.db_access import init_db
 from handlers.user_commands import register_user_handlers, UserStates
 from handlers.admin_commands import register_admin_handlers, AdminStates
@@ -31,13 +35,13 @@ from utils.pot import close_pot_and_distribute_prizes, schedule_daily_pot_open,
 from utils.payment import cashfree_webhook_handler
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+logging.basicConfig(level=CONFIG.log_level, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
 # Initialize bot with default properties
 default_properties = DefaultBotProperties(parse_mode=ParseMode.MARKDOWN)
-bot = Bot(token=BOT_TOKEN, default=default_properties)
+bot = Bot(token=CONFIG.bot_token, default=default_properties)
 
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
@@ -45,7 +49,7 @@ dp = Dispatcher(storage=storage)
 user_router = Router(name="user_router")
 admin_router = Router(name="admin_router")
 
-db_client = AsyncIOMotorClient(MONGO_URI)
+db_client = get_client()
 db = db_client.lotterydb
 
 pot_scheduler_task = None
@@ -82,8 +86,8 @@ async def close_overdue_pots_on_startup(db, bot, ist_timezone: pytz.BaseTzInfo,
 
         if pot_end_time_ist < current_time_ist:
             logger.info(f"Found overdue pot {pot_data['_id']} (ends {pot_end_time_ist.strftime('%I:%M %p IST')}), closing it now.")
-            admin_id = ADMIN_ID
-            main_channel_id = MAIN_CHANNEL_ID
+            admin_id = CONFIG.admin_id
+            main_channel_id = CONFIG.main_channel_id
             await close_pot_and_distribute_prizes(bot, db, admin_id, pot_data['_id'], main_channel_id=main_channel_id)
 
 
@@ -91,19 +95,19 @@ async def on_startup(dispatcher: Dispatcher, bot: Bot):
     global pot_scheduler_task
 
     dispatcher['db'] = db
-    dispatcher['admin_id'] = ADMIN_ID
-    dispatcher['main_channel_id'] = MAIN_CHANNEL_ID
-    dispatcher['admin_secret_code'] = ADMIN_SECRET_CODE
+    dispatcher['admin_id'] = CONFIG.admin_id
+    dispatcher['main_channel_id'] = CONFIG.main_channel_id
+    dispatcher['admin_secret_code'] = CONFIG.admin_secret_code
     dispatcher['ist_timezone'] = IST_TIMEZONE
     dispatcher['utc_timezone'] = UTC_TIMEZONE
 
-    logger.info(f"Dispatcher context set: db={db is not None}, admin_id={ADMIN_ID}, main_channel_id={MAIN_CHANNEL_ID}, admin_secret_code={'***' if ADMIN_SECRET_CODE else 'None'}, timezone='Asia/Kolkata'")
+    logger.info(f"Dispatcher context set: db={db is not None}, admin_id={CONFIG.admin_id}, main_channel_id={CONFIG.main_channel_id}, admin_secret_code={'***' if CONFIG.admin_secret_code else 'None'}, timezone='Asia/Kolkata'")
 
     await init_db(db)
     logger.info("Bot started and database initialized!")
 
     register_user_handlers(user_router)
-    register_admin_handlers(admin_router)
+    register_admin_handlers(admin_router, CONFIG.admin_secret_code)
 
     dp.include_router(user_router)
     admin_router.message.filter(lambda message, admin_id: message.from_user.id == admin_id)
@@ -114,7 +118,7 @@ async def on_startup(dispatcher: Dispatcher, bot: Bot):
     await set_default_commands(bot)
     logger.info("Default commands set.")
 
-    pot_scheduler_task = asyncio.create_task(schedule_daily_pot_open(bot, db, ADMIN_ID, MAIN_CHANNEL_ID, IST_TIMEZONE, UTC_TIMEZONE))
+    pot_scheduler_task = asyncio.create_task(schedule_daily_pot_open(bot, db, CONFIG.admin_id, CONFIG.main_channel_id, IST_TIMEZONE, UTC_TIMEZONE))
     logger.info("Pot scheduler task started.")
 
     await close_overdue_pots_on_startup(db, bot, IST_TIMEZONE, UTC_TIMEZONE)
@@ -154,5 +158,8 @@ if __name__ == '__main__':
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
     #hi
\ No newline at end of file
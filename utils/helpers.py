@@ -1,6 +1,9 @@
 import os
+import asyncio
 import logging
 import re
+import time
+from functools import lru_cache
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -15,13 +18,50 @@ def escape_markdown_V1(text: str) -> str:
     special_chars = r"_*[]()`>#+-=|{}.!"
     return re.sub(f"([{re.escape(special_chars)}])", r"\\\1", str(text))
 
+# Backslash-escapes every character that has special meaning in MarkdownV2.
+_MARKDOWN_V2_TABLE = str.maketrans({c: "\\" + c for c in r"_*[]()~`>#+-=|{}.!"})
+
 # The escape_markdown_v2 function remains from before, but the MarkdownV1 version is used in admin_commands.py
+# Usernames and order IDs repeat across listings, so escaped results are memoized.
+@lru_cache(maxsize=4096)
 def escape_markdown_v2(text: str) -> str:
     """Escapes characters that have special meaning in MarkdownV2.
     This is for raw text that should not be interpreted as Markdown at all."""
     if text is None:
         return 'N/A'
+    return str(text).translate(_MARKDOWN_V2_TABLE)
+
+# Strong references to fire-and-forget tasks; the event loop only keeps weak ones
+_background_tasks: set[asyncio.Task] = set()
+
+def _on_background_task_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Background task {task.get_name()} failed: {task.exception()}")
+
+def spawn(coro) -> asyncio.Task:
+    """Runs a coroutine in the background without awaiting it, keeping it alive until done."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_background_task_done)
+    return task
+
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions per second, with bursts of up to `rate`."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
 
-    # This regex is specifically designed to escape all characters that have special meaning in MarkdownV2.
-    special_chars = r'_*[]()~`>#+-=|{}.!'
-    return re.sub(f"([{re.escape(special_chars)}])", r"\\\1", str(text))
\ No newline at end of file
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
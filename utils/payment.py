@@ -4,7 +4,7 @@ import logging
 from datetime import datetime
 
 from db.db_access import update_user_balance, add_recharge_to_history, get_user
-from bot_config import UTC_TIMEZONE, CASHFREE_APP_ID, CASHFREE_SECRET_KEY
+from bot_config import UTC_TIMEZONE
 
 logger = logging.getLogger(__name__)
 
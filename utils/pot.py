@@ -6,12 +6,13 @@ import pytz
 import re
 import string
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 
-from db.db_access import update_pot_status, update_user_balance, set_pot_winners, get_user, update_user_upi, add_payout_history, get_pending_payouts_without_upi
+from db.db_access import update_pot_status, update_user_balances_bulk, set_pot_winners, get_users_bulk, update_user_upi, add_payout_history, get_pending_payouts_without_upi, invalidate_pot_cache, get_pot_by_date
 from utils.helpers import escape_markdown_v2
 from bot_config import (
     DEFAULT_POT_END_HOUR, DEFAULT_POT_START_HOUR, DEFAULT_MAX_USERS, DEFAULT_TICKET_PRICE,
-    REVEAL_DELAY_MINUTES, IST_TIMEZONE, UTC_TIMEZONE, ADMIN_ID, MAIN_CHANNEL_ID
+    REVEAL_DELAY_MINUTES, IST_TIMEZONE, UTC_TIMEZONE
 )
 
 logger = logging.getLogger(__name__)
@@ -24,7 +25,8 @@ def _generate_unique_ticket_code_for_pot(existing_codes):
             return code
 
 async def create_pot(db, target_date_ist: datetime.date, max_users: int = None, ticket_price: float = None,
-                     custom_start_time_ist: datetime = None, custom_end_time_ist: datetime = None):
+                     custom_start_time_ist: datetime = None, custom_end_time_ist: datetime = None,
+                     replace_stale: bool = False):
     if custom_start_time_ist and custom_end_time_ist:
         start_time_ist = custom_start_time_ist
         end_time_ist = custom_end_time_ist
@@ -44,8 +46,24 @@ async def create_pot(db, target_date_ist: datetime.date, max_users: int = None,
         "winners": [],
         "prize_pool": 0.0
     }
-    result = await db.pots.insert_one(pot_data)
+    stale_pot = None
+    if replace_stale:
+        # The date's closed/revealed pot is moved to pots_archive, keeping its _id, so payouts
+        # and tickets that reference it still resolve and the new pot gets a fresh _id
+        stale_pot = await db.pots.find_one_and_delete({"date": pot_data['date'], "status": {"$in": ["closed", "revealed"]}})
+    try:
+        if stale_pot:
+            result, _ = await asyncio.gather(db.pots.insert_one(pot_data), db.pots_archive.insert_one(stale_pot))
+        else:
+            result = await db.pots.insert_one(pot_data)
+    except DuplicateKeyError:
+        if not replace_stale:
+            raise
+        logger.warning(f"Not replacing pot for {pot_data['date']}: an open pot already exists.")
+        invalidate_pot_cache()
+        return None
     pot_data['_id'] = result.inserted_id
+    invalidate_pot_cache()
     logger.info(f"New pot created for IST date {target_date_ist.isoformat()} (UTC times: {pot_data['start_time']} - {pot_data['end_time']})")
 
     # FIX: Scalable ticket generation based on pot size
@@ -87,10 +105,11 @@ async def create_pot(db, target_date_ist: datetime.date, max_users: int = None,
 
 async def get_current_pot(db, ist_timezone: pytz.BaseTzInfo):
     today_ist_date_str = datetime.now(ist_timezone).date().isoformat()
-    return await db.pots.find_one({
-        "date": today_ist_date_str,
-        "status": {"$in": ["open", "closed", "revealed"]}
-    })
+    # Served from the short-lived by-date cache; every pot write goes through invalidate_pot_cache
+    pot = await get_pot_by_date(db, today_ist_date_str)
+    if pot and pot.get('status') in ("open", "closed", "revealed"):
+        return pot
+    return None
 
 async def process_pot_revelation(bot, db, admin_id: int, pot_data: dict, main_channel_id: int, ist_timezone: pytz.BaseTzInfo, interactive_reveal: bool = False):
     pot_id = pot_data['_id']
@@ -107,18 +126,23 @@ async def process_pot_revelation(bot, db, admin_id: int, pot_data: dict, main_ch
 
     if num_participants < 10:
         logger.info(f"Pot {pot_id}: Less than 10 participants ({num_participants}). Refunding all tickets.")
+        existing_users = await get_users_bulk(db, (participant['telegram_id'] for participant in participants), {"_id": 0, "telegram_id": 1})
+        refunded_user_ids = []
         for participant in participants:
             user_id = participant['telegram_id']
-            user_data = await get_user(db, user_id)
-            if user_data:
-                await update_user_balance(db, user_id, real_amount=ticket_price)
-                try:
-                    await bot.send_message(user_id, f"😢 Oh no! Today's LuckyDrop pot had less than 10 participants. Your **₹{ticket_price:.2f}** ticket price has been refunded to your real wallet. Better luck next time! 🍀")
-                except Exception as e:
-                    logger.warning(f"Could not send refund message to user {user_id}: {e}")
+            if user_id in existing_users:
+                refunded_user_ids.append(user_id)
             else:
                 logger.warning(f"User {user_id} not found for refund in pot {pot_id}.")
 
+        # All refunds go out as one bulk write before anyone is notified
+        await update_user_balances_bulk(db, [(user_id, ticket_price, 0.0) for user_id in refunded_user_ids])
+        for user_id in refunded_user_ids:
+            try:
+                await bot.send_message(user_id, f"😢 Oh no! Today's LuckyDrop pot had less than 10 participants. Your **₹{ticket_price:.2f}** ticket price has been refunded to your real wallet. Better luck next time! 🍀")
+            except Exception as e:
+                logger.warning(f"Could not send refund message to user {user_id}: {e}")
+
         await update_pot_status(db, pot_id, "revealed")
         if main_channel_id:
             try:
@@ -175,12 +199,16 @@ async def process_pot_revelation(bot, db, admin_id: int, pot_data: dict, main_ch
     # NEW: Admin payout summary message
     admin_payouts_summary = ["🚨 **PAYOUTS TO PROCESS!** 🚨\n\n"]
 
+    winner_users = await get_users_bulk(
+        db, (rank_info["winner_obj"]['telegram_id'] for rank_info in winners_data_for_reveal),
+        {"_id": 0, "telegram_id": 1, "username": 1, "upi_id": 1}
+    )
     for i, rank_info in enumerate(winners_data_for_reveal):
         winner = rank_info["winner_obj"]
         prize = rank_info["prize"]
         rank_name = rank_info["rank"]
 
-        winner_user = await get_user(db, winner['telegram_id'])
+        winner_user = winner_users.get(winner['telegram_id'])
         winner_username_display = escape_markdown_v2(winner_user.get('username')) if winner_user and winner_user.get('username') else str(winner['telegram_id'])
         ticket_code = winner['ticket_code']
         winner_upi_id = winner_user.get('upi_id') if winner_user else "Not set"
@@ -277,8 +305,11 @@ async def schedule_daily_pot_open(bot, db, admin_id: int, main_channel_id: int,
         pot_open_time_default_ist = ist_timezone.localize(datetime.combine(today_ist_date, time(DEFAULT_POT_START_HOUR, 0, 0)))
 
         # FIX: Check if a pot with an "open" status exists for today. This allows for multiple pots.
-        open_pot = await db.pots.find_one({"date": today_ist_date_str, "status": "open"})
-        closed_or_revealed_pot = await db.pots.find_one({"date": today_ist_date_str, "status": {"$in": ["closed", "revealed"]}})
+        # The date is unique, so one cached lookup answers both questions
+        todays_pot = await get_pot_by_date(db, today_ist_date_str)
+        todays_status = todays_pot.get('status') if todays_pot else None
+        open_pot = todays_pot if todays_status == "open" else None
+        closed_or_revealed_pot = todays_pot if todays_status in ("closed", "revealed") else None
 
         if open_pot:
             pot_end_time_ist = open_pot.get('end_time').astimezone(ist_timezone)
@@ -347,16 +378,18 @@ async def send_payout_reminders(bot, db):
         await asyncio.sleep(3600)
 
 async def close_pot_and_distribute_prizes(bot, db, admin_id: int, pot_id, main_channel_id: int = None):
-    current_pot = await db.pots.find_one({"_id": pot_id})
+    # Reading the pot and closing it is one conditional write, so two closers can't both proceed
+    current_pot = await db.pots.find_one_and_update(
+        {"_id": pot_id, "status": "open"},
+        {"$set": {"status": "closed"}},
+        projection={"participants": 1, "date": 1}
+    )
     if not current_pot:
-        logger.error(f"Pot with ID {pot_id} not found for closing.")
+        logger.info(f"Pot {pot_id} not found or no longer open. No action needed for closing.")
         return
+    invalidate_pot_cache()
     participants = current_pot.get('participants', [])
     num_participants = len(participants)
-    ticket_price = current_pot.get('ticket_price', 50.0)
-    if current_pot.get('status') != 'open':
-        logger.info(f"Pot {pot_id} is already '{current_pot.get('status')}'. No action needed for closing.")
-        return
 
     all_tickets_in_pot = await db.tickets.find({"pot_id": pot_id}).to_list(length=None)
     sold_ticket_codes = {p['ticket_code'] for p in current_pot.get('participants', [])}
@@ -381,7 +414,6 @@ async def close_pot_and_distribute_prizes(bot, db, admin_id: int, pot_id, main_c
 
     if num_participants < 2:
         logger.info(f"Pot {pot_id}: Less than 2 participants ({num_participants}). Proceeding to refund all tickets.")
-        await update_pot_status(db, pot_id, "closed")
         if main_channel_id:
             try:
                 await bot.send_message(main_channel_id,
@@ -394,7 +426,6 @@ async def close_pot_and_distribute_prizes(bot, db, admin_id: int, pot_id, main_c
         logger.info(f"Pot {pot_id} status set to 'closed' for refund processing.")
     else:
         logger.info(f"Pot {pot_id}: {num_participants} participants. Marking as closed for admin/auto reveal.")
-        await update_pot_status(db, pot_id, "closed")
         if main_channel_id:
             try:
                 await bot.send_message(main_channel_id,
@@ -453,9 +484,13 @@ async def get_current_pot_status(pot_data, detailed: bool = False, db=None, ist_
             f"\n\n**Pot ID:** `{str(pot_data['_id'])}`\n"
             f"**Current Participants:**\n"
         )
+        listed_ids = [participant['telegram_id'] for participant in pot_data['participants']]
+        if status == 'revealed':
+            listed_ids.extend(winner['telegram_id'] for winner in pot_data.get('winners') or [])
+        users_by_id = await get_users_bulk(db, listed_ids, {"_id": 0, "telegram_id": 1, "username": 1})
         if filled_count > 0:
             for participant in pot_data['participants']:
-                user_obj = await get_user(db, participant['telegram_id'])
+                user_obj = users_by_id.get(participant['telegram_id'])
                 username = escape_markdown_v2(user_obj.get('username')) if user_obj and user_obj.get('username') else f"User {participant['telegram_id']}"
                 message += f"- {username} (ID: {participant['telegram_id']}) - Ticket: `{participant['ticket_code']}`\n"
         else:
@@ -465,7 +500,7 @@ async def get_current_pot_status(pot_data, detailed: bool = False, db=None, ist_
             rank_order_map = {"3rd": 3, "2nd": 2, "1st": 1}
             display_winners = sorted(pot_data['winners'], key=lambda x: rank_order_map[x['rank']])
             for winner in display_winners:
-                winner_user_obj = await get_user(db, winner['telegram_id'])
+                winner_user_obj = users_by_id.get(winner['telegram_id'])
                 winner_username = escape_markdown_v2(winner_user_obj.get('username')) if winner_user_obj and winner_user_obj.get('username') else f"User {winner['telegram_id']}"
                 winner_upi_id = escape_markdown_v2(winner.get('upi_id', 'Not Set'))
                 message += f"- {winner['rank']}: [{winner_username}](tg://user?id={winner['telegram_id']}) (Ticket: `{winner['ticket_code']}`) - Prize: ₹{winner['prize']:.2f} (UPI: `{winner_upi_id}`)\n"
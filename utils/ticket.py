@@ -18,16 +18,14 @@ async def generate_unique_ticket_code(db):
     while True:
         code = ''.join(random.choices(string.digits, k=6))
 
-        user_with_code = await db.users.find_one({"last_ticket_code": code})
-        if user_with_code:
+        if await db.users.count_documents({"last_ticket_code": code}, limit=1):
             logger.debug(f"Generated ticket code {code} already in use by a user. Retrying.")
             continue
 
-        pot_with_code = await db.pots.find_one({
+        if await db.pots.count_documents({
             "status": {"$in": ["open", "closed", "revealed"]},
             "participants.ticket_code": code
-        })
-        if pot_with_code:
+        }, limit=1):
             logger.debug(f"Generated ticket code {code} already in use in a pot. Retrying.")
             continue
 